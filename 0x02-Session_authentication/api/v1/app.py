@@ -14,6 +14,7 @@ from flask import request
 from api.v1.auth.session_auth import SessionAuth
 from api.v1.views import app_views
 from api.v1.auth.auth import Auth
+from api.v1.auth.context import AuthContext
 from api.v1.auth.session_exp_auth import SessionExpAuth
 from api.v1.auth.basic_auth import BasicAuth
 from api.v1.auth.session_db_auth import SessionDBAuth
@@ -81,6 +82,28 @@ def forbddn_errorhandler(error) -> str:
     return jsonify({"error": "Forbidden"}), 403
 
 
+# Gestionnaire d'erreur 429 - Trop de requêtes
+@app.errorhandler(429)
+def too_many_requests_errorhandler(error) -> str:
+    """Gestionnaire pour les
+    erreurs 429 - Trop de requêtes.
+    """
+    return jsonify({"error": "Too many requests"}), 429
+
+
+# Liste des chemins d'URL exclus de l'authentification,
+# compilée par auth à sa première utilisation
+EXCLUDED_PATHS = [
+    "/api/v1/status/",  # Route pour vérifier le statut de l'API
+    # Route pour tester les erreurs d'autorisation
+    "/api/v1/unauthorized/",
+    # Route pour tester les erreurs d'interdiction
+    "/api/v1/forbidden/",
+    # Route pour la connexion des sessions
+    "/api/v1/auth_session/login/"
+]
+
+
 # Fonction appelée avant le traitement de chaque requête
 @app.before_request
 def authenticate_usr_beforerequest():
@@ -88,39 +111,32 @@ def authenticate_usr_beforerequest():
     le traitement d'une requête.
     """
     if auth:
-        # Liste des chemins d'URL exclus
-        # de l'authentification
-        excluded_paths = [
-            "/api/v1/status/",  # Route pour vérifier le statut de l'API
-            # Route pour tester les erreurs d'autorisation
-            "/api/v1/unauthorized/",
-            # Route pour tester les erreurs d'interdiction
-            "/api/v1/forbidden/",
-            # Route pour la connexion des sessions
-            "/api/v1/auth_session/login/"
-        ]
-
-        # Vérifie si le chemin de la requête
-
-        if not auth.require_auth(request.path, excluded_paths):
-            return
-
         # Vérifie si le chemin de la requête
         # nécessite une authentification
-        if auth.require_auth(request.path, excluded_paths):
-            # Récupère l'utilisateur actuel basé sur la requête
-            user = auth.current_user(request)
-            # Si l'en-tête d'autorisation et le cookie de session sont absents
-            if auth.authorization_header(request) is None and \
-                    auth.session_cookie(request) is None:
-                # Retourne une erreur 401 (Non autorisé)
-                abort(401)
-            # Si l'utilisateur est non identifié,
-            # retourne une erreur 403 (Interdit)
-            if user is None:
-                abort(403)
-            # Assigne l'utilisateur authentifié à la requête
-            request.current_user = user
+        if not auth.require_auth(request.path, EXCLUDED_PATHS):
+            AuthContext.count('excluded')
+            return
+        # Lit une seule fois l'en-tête et le cookie de la requête
+        contexte = AuthContext.of(auth, request)
+        # Si l'en-tête d'autorisation et le cookie de session sont
+        # absents, retourne une erreur 401 sans chercher d'utilisateur
+        if contexte.anonymous:
+            AuthContext.count('anonymous')
+            abort(401)
+        # Récupère l'utilisateur actuel, mémorisé pour la requête
+        user = contexte.user
+        # Si l'utilisateur est non identifié,
+        # retourne une erreur 403 (Interdit)
+        if user is None:
+            # Trop d'échecs récents : retourne une erreur 429
+            if getattr(request, 'auth_throttled', False):
+                AuthContext.count('throttled')
+                abort(429)
+            AuthContext.count('forbidden')
+            abort(403)
+        AuthContext.count('authenticated')
+        # Assigne l'utilisateur authentifié à la requête
+        request.current_user = user
 
 
 # Exécution de l'application Flask
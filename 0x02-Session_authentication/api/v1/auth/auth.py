@@ -5,17 +5,107 @@ Auteur SAID LAMGHARI
 """
 import os
 from flask import request
-import re
+from functools import lru_cache
 from typing import List
 from typing import TypeVar
 
 
+# Nombre de chemins de requête mémorisés par ExcludedPaths
+PATH_CACHE_SIZE = 1024
+# Nombre de listes d'exclusion compilées gardées par Auth
+MATCHERS_MAX = 16
+# Marque la fin d'un préfixe dans le trie
+_FIN = ''
+
+
+class ExcludedPaths:
+    """Liste de chemins exclus de l'authentification,
+    compilée une seule fois.
+
+    Un chemin se terminant par une étoile (*) exclut tout chemin
+    commençant par ce qui précède l'étoile : ces préfixes forment un
+    trie parcouru caractère par caractère. Les autres chemins excluent
+    le chemin lui-même et tout ce qui se trouve sous lui : ils sont
+    rangés dans un ensemble, sans slash final, et comparés à chaque
+    ancêtre du chemin de la requête. Le slash final est ignoré des
+    deux côtés. Les derniers chemins de requête vus passent par un
+    cache LRU.
+    """
+
+    def __init__(self, excluded_paths: List[str]):
+        """Compile la liste `excluded_paths`.
+        """
+        self.exacts = set()
+        self.trie = {}
+        for exclusion_path in (ep.strip() for ep in excluded_paths):
+            if exclusion_path.endswith('*'):
+                noeud = self.trie
+                for caractere in exclusion_path[:-1]:
+                    noeud = noeud.setdefault(caractere, {})
+                noeud[_FIN] = True
+            else:
+                self.exacts.add(exclusion_path.rstrip('/'))
+        self.match = lru_cache(maxsize=PATH_CACHE_SIZE)(self._match)
+
+    def _match(self, path: str) -> bool:
+        """Vérifie si `path` est exclu, sans passer par le cache.
+        """
+        # Normalise le slash final
+        path = path.rstrip('/')
+        # Le chemin lui-même puis chacun de ses ancêtres
+        if path in self.exacts:
+            return True
+        position = path.find('/')
+        while position >= 0:
+            if path[:position] in self.exacts:
+                return True
+            position = path.find('/', position + 1)
+        # Préfixes des exclusions avec étoile
+        noeud = self.trie
+        if _FIN in noeud:
+            return True
+        for caractere in path + '/':
+            noeud = noeud.get(caractere)
+            if noeud is None:
+                return False
+            if _FIN in noeud:
+                return True
+        return False
+
+
 class Auth:
     """
     Classe d'authentification.
     Cette classe fournit des méthodes de base
     pour gérer l'authentification des requêtes API.
     """
+
+    def __init__(self) -> None:
+        """Initialise le cache des listes d'exclusion compilées.
+        """
+        self._matchers = {}
+        # Dernière liste reçue, sa copie et sa version compilée
+        self._last = (None, None, None)
+
+    def _matcher(self, excluded_paths: List[str]) -> ExcludedPaths:
+        """Retourne la liste `excluded_paths` compilée,
+        en la compilant à sa première utilisation.
+        """
+        # La même liste, inchangée, est passée à chaque requête :
+        # la comparer à sa copie évite de la hacher
+        last, copie, matcher = self._last
+        if excluded_paths is last and excluded_paths == copie:
+            return matcher
+        key = tuple(excluded_paths)
+        matcher = self._matchers.get(key)
+        if matcher is None:
+            if len(self._matchers) >= MATCHERS_MAX:
+                self._matchers.clear()
+            matcher = ExcludedPaths(excluded_paths)
+            self._matchers[key] = matcher
+        self._last = (excluded_paths, list(excluded_paths), matcher)
+        return matcher
+
     def require_auth(self, path: str,
                      excluded_paths: List[str]) -> bool:
         """Vérifie si un chemin nécessite une authentification.
@@ -23,44 +113,21 @@ class Auth:
         Arguments :
           - path : Chemin de l'URL de la requête.
           - excluded_paths : Liste des chemins
-          d'URL qui sont exclus de l'authentification.
+          d'URL qui sont exclus de l'authentification
+          (voir ExcludedPaths).
 
         Retourne :
           - True si le chemin nécessite une authentification.
           - False si le chemin est dans
           les chemins exclus de l'authentification.
         """
-        if not path:
-            return True
-
         # Assure que les paramètres ne sont pas None
-        if path and excluded_paths:
-            # Parcourt chaque chemin d'exclusion
-            # en supprimant les espaces superflus
-            for exclusion_path in (ep.strip() for ep in excluded_paths):
-                # Détermine le motif de correspondance
-                # en fonction du type de chemin d'exclusion
-                if exclusion_path.endswith('*'):
-                    # Exclusion avec étoile (*), correspond
-                    # à tout chemin commençant par exclusion_path
-                    pattern = f'{exclusion_path[:-1]}.*'
-                elif exclusion_path.endswith('/'):
-                    # Exclusion avec un slash (/), correspond
-                    # à tout chemin sous exclusion_path
-                    pattern = f'{exclusion_path[:-1]}/.*'
-                else:
-                    # Exclusion simple, correspond à
-                    # tout chemin sous exclusion_path
-                    pattern = f'{exclusion_path}/.*'
-
-                # Vérifie si le chemin de la requête
-                # correspond au motif d'exclusion
-                if re.match(pattern, path):
-                    return False
+        if not path or not excluded_paths:
+            return True
 
         # Retourne True si aucune correspondance
         # avec les chemins exclus n'est trouvée
-        return True
+        return not self._matcher(excluded_paths).match(path)
 
     def authorization_header(self,
                              request=None) -> str:
@@ -77,6 +144,10 @@ class Auth:
         """
         # Vérifie que la requête est fournie
         if request is not None:
+            # Valeur déjà lue par le contexte de la requête
+            contexte = getattr(request, 'auth_context', None)
+            if contexte is not None:
+                return contexte.authorization_header
             # Retourne la valeur de l'en-tête
             # 'Authorization' de la requête
             return request.headers.get('Authorization', None)
@@ -110,6 +181,10 @@ class Auth:
         """
         # Vérifie que la requête est fournie
         if request is not None:
+            # Valeur déjà lue par le contexte de la requête
+            contexte = getattr(request, 'auth_context', None)
+            if contexte is not None:
+                return contexte.session_cookie
             # Récupère le nom du cookie depuis
             # les variables d'environnement
             ckie_name = os.getenv('SESSION_NAME')
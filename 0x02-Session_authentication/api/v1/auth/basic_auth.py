@@ -3,12 +3,15 @@
 Module d'authentification
 de base pour l'API.
 """
+import os
 import re
 from typing import TypeVar
 import base64
 from models.user import User
 import binascii
 from .auth import Auth
+from .credential_cache import CredentialCache
+from .rate_limit import login_keys, login_limiter
 from typing import Tuple
 
 
@@ -20,7 +23,32 @@ class BasicAuth(Auth):
     """
     Classe d'authentification
     de base.
+
+    Les en-têtes vérifiés sont mémorisés pendant BASIC_AUTH_CACHE_TTL
+    secondes (10 par défaut, 0 pour désactiver le cache), dans la
+    limite de BASIC_AUTH_CACHE_SIZE en-têtes (voir CredentialCache).
     """
+
+    def __init__(self) -> None:
+        """Initialise le cache des identifiants vérifiés.
+        """
+        super().__init__()
+        try:
+            ttl = float(os.getenv('BASIC_AUTH_CACHE_TTL', '10'))
+        except ValueError:
+            ttl = 10
+        try:
+            size = int(os.getenv('BASIC_AUTH_CACHE_SIZE', '1024'))
+        except ValueError:
+            size = 1024
+        self.credential_cache = CredentialCache(ttl, size)
+
+    def credential_cache_stats(self) -> dict:
+        """Retourne les succès, échecs et invalidations
+        du cache des identifiants vérifiés.
+        """
+        return self.credential_cache.stats()
+
     def extract_base64_authorization_header(self,
                                             authorization_header: str) -> str:
         """Extrait la partie Base64 de l'en-tête Authorization
@@ -102,6 +130,41 @@ class BasicAuth(Auth):
                 user = match_terrain.group('user')
                 password = match_terrain.group('password')
                 return user, password
+        return None, None
+
+    def parse_authorization_header(self,
+                                   authorization_header: str
+                                   ) -> Tuple[str, str]:
+        """Extrait en une passe l'email et le mot de passe d'un en-tête
+        Authorization, comme les trois méthodes précédentes enchaînées
+        mais sans expression régulière.
+
+        Args:
+            authorization_header (str): L'en-tête Authorization brut.
+
+        Returns:
+            Tuple[str, str]: L'email et le mot de passe,
+            ou (None, None) si l'en-tête n'est pas valide.
+        """
+        if not isinstance(authorization_header, str):
+            return None, None
+        entete = authorization_header.strip()
+        if len(entete) <= 6 or not entete.startswith('Basic '):
+            return None, None
+        try:
+            # Un seul décodage, qui rejette les caractères hors base64
+            decode = base64.b64decode(entete[6:], validate=True)
+            decode = decode.decode('utf-8').strip()
+        except ValueError:
+            # binascii.Error, UnicodeDecodeError ou jeton non ASCII
+            return None, None
+        # L'email s'arrête au premier deux-points,
+        # le mot de passe peut en contenir
+        email, deux_points, password = decode.partition(':')
+        if not email or not deux_points or not password or \
+                '\n' in password:
+            return None, None
+        return email, password
 
     def user_object_from_credentials(self,
                                      user_email: str,
@@ -146,16 +209,37 @@ class BasicAuth(Auth):
 
         Returns:
             UserType: L'utilisateur actuellement
-            authentifié, ou None si l'authentification échoue.
+            authentifié, ou None si l'authentification échoue
+            ou si les échecs de ce client ou de cet email dépassent
+            la limite de login_limiter (request.auth_throttled
+            vaut alors True).
         """
         # Extraction de l'en-tête d'autorisation
         entete = self.authorization_header(request)
-        # Extraction du token Base64 de l'en-tête
-        b64_entete = self.extract_base64_authorization_header(entete)
-        # Décodage du token Base64
-        tknofauth = self.decode_base64_authorization_header(b64_entete)
         # Extraction des informations d'identification de l'utilisateur
-        email, password = self.extract_user_credentials(tknofauth)
+        email, password = self.parse_authorization_header(entete)
+        # Refuse une tentative au-delà de la limite
+        # avant tout hachage ou recherche d'utilisateur
+        cles = login_keys(getattr(request, 'remote_addr', None), email)
+        if not login_limiter.allow(*cles):
+            if request is not None:
+                request.auth_throttled = True
+            return None
+        # Un en-tête déjà vérifié évite la recherche et le hachage
+        cle = None
+        if email is not None and self.credential_cache.enabled:
+            cle = self.credential_cache.key(entete)
+            user = self.credential_cache.get(cle)
+            if user is not None:
+                return user
         # Récupération de l'objet utilisateur basé
         # sur les informations d'identification
-        return self.user_object_from_credentials(email, password)
+        user = self.user_object_from_credentials(email, password)
+        if user is None:
+            if email is not None:
+                # Compte l'échec pour le client et pour l'email
+                login_limiter.failure(*cles)
+            return None
+        if cle is not None:
+            self.credential_cache.put(cle, user)
+        return user
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Module du contexte d'authentification d'une requête.
+"""
+import threading
+from typing import TypeVar
+
+
+# Valeur de l'utilisateur pas encore recherché
+_INCONNU = object()
+
+
+class AuthContext:
+    """Contexte d'authentification propre à une requête.
+
+    L'en-tête Authorization et le cookie de session sont lus une seule
+    fois, une requête sans aucun des deux est reconnue anonyme sans
+    chercher d'utilisateur, et l'utilisateur trouvé est mémorisé pour
+    le reste de la requête.
+
+    Le nombre de passages par chaque étape est compté dans
+    `AuthContext.stats()`.
+    """
+
+    # Compteurs des étapes, communs à toutes les requêtes
+    _compteurs = {'requests': 0, 'excluded': 0, 'anonymous': 0,
+                  'user_lookups': 0, 'user_memoized': 0,
+                  'authenticated': 0, 'forbidden': 0, 'throttled': 0}
+    _verrou = threading.Lock()
+
+    def __init__(self, auth, request) -> None:
+        """Lit les informations d'authentification de `request`.
+        """
+        self.auth = auth
+        self.request = request
+        self.authorization_header = auth.authorization_header(request)
+        self.session_cookie = auth.session_cookie(request)
+        self._user = _INCONNU
+        self.count('requests')
+
+    @classmethod
+    def of(cls, auth, request) -> 'AuthContext':
+        """Retourne le contexte de `request`, en le créant
+        à sa première utilisation.
+        """
+        contexte = getattr(request, 'auth_context', None)
+        if contexte is None:
+            contexte = cls(auth, request)
+            request.auth_context = contexte
+        return contexte
+
+    @classmethod
+    def count(cls, etape: str) -> None:
+        """Compte un passage par l'étape `etape`.
+        """
+        with cls._verrou:
+            cls._compteurs[etape] = cls._compteurs.get(etape, 0) + 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Retourne une copie des compteurs des étapes.
+        """
+        with cls._verrou:
+            return dict(cls._compteurs)
+
+    @property
+    def anonymous(self) -> bool:
+        """True si la requête n'a ni en-tête
+        Authorization ni cookie de session.
+        """
+        return self.authorization_header is None and \
+            self.session_cookie is None
+
+    @property
+    def user(self) -> TypeVar('User'):
+        """Retourne l'utilisateur de la requête, recherché
+        une seule fois, ou None s'il n'est pas identifié.
+        """
+        if self._user is not _INCONNU:
+            self.count('user_memoized')
+            return self._user
+        if self.anonymous:
+            # Aucune information d'authentification à vérifier
+            self._user = None
+            return None
+        self.count('user_lookups')
+        self._user = self.auth.current_user(self.request)
+        return self._user
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Module du cache des identifiants vérifiés de l'authentification de base.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
+from typing import TypeVar
+
+from models.user import User
+
+
+class CredentialCache:
+    """Cache borné associant un en-tête Authorization déjà vérifié
+    à l'identifiant de son utilisateur, pendant `ttl` secondes.
+
+    Les en-têtes ne sont pas conservés : la clé est un hachage BLAKE2b
+    à clé secrète, tirée au hasard au démarrage du processus. Une entrée
+    retient aussi le mot de passe haché et la date de mise à jour de
+    l'utilisateur : si son enregistrement a changé ou a été supprimé
+    depuis, l'entrée est invalidée et l'en-tête vérifié à nouveau.
+    Au-delà de `size` entrées, la moins récemment utilisée est retirée.
+    """
+
+    def __init__(self, ttl: float = 10, size: int = 1024) -> None:
+        """Initialise un cache vide.
+        """
+        self.ttl = ttl
+        self.size = size
+        self._secret = os.urandom(32)
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+        self._compteurs = {'hits': 0, 'misses': 0, 'expired': 0,
+                           'invalidated': 0, 'evicted': 0}
+
+    @property
+    def enabled(self) -> bool:
+        """True si le cache conserve des entrées.
+        """
+        return self.ttl > 0 and self.size > 0
+
+    def key(self, authorization_header: str) -> bytes:
+        """Retourne la clé de l'en-tête `authorization_header`.
+        """
+        return hashlib.blake2b(authorization_header.encode(),
+                               key=self._secret, digest_size=16).digest()
+
+    def get(self, key: bytes) -> TypeVar('User'):
+        """Retourne l'utilisateur vérifié pour la clé `key`,
+        ou None si l'en-tête doit être vérifié.
+        """
+        with self._verrou:
+            entree = self._entrees.get(key)
+            if entree is None:
+                self._compteurs['misses'] += 1
+                return None
+            user_id, password, updated_ts, expiration = entree
+            if time.monotonic() >= expiration:
+                del self._entrees[key]
+                self._compteurs['expired'] += 1
+                self._compteurs['misses'] += 1
+                return None
+            self._entrees.move_to_end(key)
+        user = User.get(user_id)
+        if user is None or user.password != password or \
+                user._updated_ts != updated_ts:
+            # L'utilisateur a changé depuis la vérification
+            with self._verrou:
+                self._entrees.pop(key, None)
+                self._compteurs['invalidated'] += 1
+                self._compteurs['misses'] += 1
+            return None
+        with self._verrou:
+            self._compteurs['hits'] += 1
+        return user
+
+    def put(self, key: bytes, user: TypeVar('User')) -> None:
+        """Mémorise que la clé `key` identifie `user`.
+        """
+        if not self.enabled:
+            return
+        entree = (user.id, user.password, user._updated_ts,
+                  time.monotonic() + self.ttl)
+        with self._verrou:
+            self._entrees[key] = entree
+            self._entrees.move_to_end(key)
+            while len(self._entrees) > self.size:
+                self._entrees.popitem(last=False)
+                self._compteurs['evicted'] += 1
+
+    def clear(self) -> None:
+        """Vide le cache.
+        """
+        with self._verrou:
+            self._entrees.clear()
+
+    def stats(self) -> dict:
+        """Retourne les compteurs du cache et son nombre d'entrées.
+        """
+        with self._verrou:
+            stats = dict(self._compteurs)
+            stats['entries'] = len(self._entrees)
+        return stats
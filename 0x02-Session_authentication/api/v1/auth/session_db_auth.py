@@ -8,6 +8,9 @@ from flask import request
 from models.user_session import UserSession
 
 from datetime import datetime, timedelta
+import os
+import threading
+import time
 
 
 from .session_exp_auth import SessionExpAuth
@@ -16,8 +19,61 @@ from .session_exp_auth import SessionExpAuth
 class SessionDBAuth(SessionExpAuth):
     """Classe d'authentification de session
     avec expiration et prise en charge du stockage.
+
+    Un thread de fond supprime les sessions expirées toutes les
+    SESSION_REAP_INTERVAL secondes (60 par défaut, 0 pour le
+    désactiver), en un seul lot écrit une fois par passage. Un passage
+    supprime au plus SESSION_REAP_BATCH sessions (0 par défaut : toutes),
+    les suivantes attendant le passage suivant.
     """
 
+    def __init__(self) -> None:
+        """Initialise l'authentification et démarre le nettoyage
+        des sessions expirées.
+        """
+        super().__init__()
+        self.reap_interval = self._get_env_int('SESSION_REAP_INTERVAL', 60)
+        self.reap_batch = max(0, self._get_env_int('SESSION_REAP_BATCH',
+                                                   0))
+        # Sans durée de vie, les sessions n'expirent pas
+        if self.reap_interval > 0 and self.session_duration > 0:
+            reaper = threading.Thread(target=self._reaper_loop,
+                                      name="session-reaper", daemon=True)
+            reaper.start()
+
+    @staticmethod
+    def _get_env_int(name: str, default: int) -> int:
+        """Récupère un entier depuis une variable d'environnement,
+        `default` si elle est absente ou invalide.
+        """
+        try:
+            return int(os.getenv(name, str(default)))
+        except ValueError:
+            return default
+
+    def reap_expired_sessions(self) -> int:
+        """Supprime les sessions expirées, au plus SESSION_REAP_BATCH,
+        en un seul lot écrit une fois.
+
+        Returns:
+            int: Le nombre de sessions supprimées.
+        """
+        if self.session_duration <= 0:
+            return 0
+        return UserSession.remove_expired(self.session_duration,
+                                          self.reap_batch or None)
+
+    def _reaper_loop(self) -> None:
+        """Boucle du thread de nettoyage des sessions expirées.
+        """
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.reap_expired_sessions()
+            except Exception:
+                # Une erreur de stockage ne doit pas arrêter le thread
+                pass
+
     def create_session(self,
                        user_id=None) -> str:
         """Crée et stocke un identifiant de session pour l'utilisateur.
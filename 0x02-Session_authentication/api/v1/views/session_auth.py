@@ -6,6 +6,7 @@ Auteuur SAID LAMGHARI
 import os
 from typing import Tuple
 from api.v1.app import auth
+from api.v1.auth.rate_limit import login_keys, login_limiter
 
 from flask import abort
 from flask import jsonify, request
@@ -26,6 +27,7 @@ def for_login() -> Tuple[str, int]:
       - 400 si l'email ou le mot de passe est manquant.
       - 404 si aucun utilisateur n'est trouvé avec cet email.
       - 401 si le mot de passe est incorrect.
+      - 429 après trop d'échecs récents de ce client ou pour cet email.
     """
     no_rslt = {"error": "no user found for this email"}
 
@@ -40,6 +42,12 @@ def for_login() -> Tuple[str, int]:
         # Retourne une erreur si le mot de passe est manquant ou vide
         return jsonify({"error": "password missing"}), 400
 
+    # Refuse la tentative au-delà de la limite,
+    # avant la recherche et le hachage
+    cles = login_keys(request.remote_addr, email)
+    if not login_limiter.allow(*cles):
+        return jsonify({"error": "too many attempts"}), 429
+
     try:
         # Recherche les utilisateurs par email
         users = User.search({'email': email})
@@ -49,6 +57,7 @@ def for_login() -> Tuple[str, int]:
 
     if len(users) <= 0:
         # Retourne une erreur 404 si aucun utilisateur n'est trouvé
+        login_limiter.failure(*cles)
         return jsonify(no_rslt), 404
 
     if users[0].is_valid_password(password):
@@ -61,6 +70,7 @@ def for_login() -> Tuple[str, int]:
         return rslt
 
     # Retourne une erreur 401 si le mot de passe est incorrect
+    login_limiter.failure(*cles)
     return jsonify({"error": "wrong password"}), 401
 
 
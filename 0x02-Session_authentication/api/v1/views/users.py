@@ -2,18 +2,44 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request
 from models.user import User
 
 
+def users_json(users) -> Response:
+    """ JSON list response made of the cached encodings of `users`
+    """
+    body = b"[" + b",".join(user.to_json_bytes() for user in users) + b"]\n"
+    return Response(body, mimetype='application/json')
+
+
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: number of users per page (default: 100 with a cursor)
+      - cursor: X-Next-Cursor header of the previous page
     Return:
       - list of all User objects JSON represented
+      - with limit or cursor: one page of User objects ordered by
+        creation date, and the X-Next-Cursor header if more may follow
+      - 400 if limit or cursor is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    if limit is None and cursor is None:
+        return users_json(User.all())
+    try:
+        limit = int(limit) if limit is not None else 100
+        if limit <= 0:
+            raise ValueError(limit)
+        users = list(User.iter_search({}, cursor=cursor, limit=limit))
+    except ValueError:
+        return jsonify({'error': "Wrong pagination"}), 400
+    rslt = users_json(users)
+    if len(users) == limit:
+        rslt.headers['X-Next-Cursor'] = users[-1].cursor()
+    return rslt
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -30,7 +56,8 @@ def view_one_user(user_id: str = None) -> str:
     user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    return Response(user.to_json_bytes() + b"\n",
+                    mimetype='application/json')
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+""" Authorization header parsing: the step-by-step BasicAuth methods
+against the single-pass parser
+
+Usage: python3 -m benchmarks.basic_auth_parse [rounds]
+"""
+import base64
+import sys
+import time
+from api.v1.auth.basic_auth import BasicAuth
+
+
+HEADERS = [
+    "Basic " + base64.b64encode(b"bob@hbtn.io:H0lbertonSchool98!").decode(),
+    "  Basic " + base64.b64encode(b"a@b.io:pass:with:colons").decode(),
+    "Basic " + base64.b64encode(b"no-colon").decode(),
+    "Basic not base64!",
+    "Bearer abc",
+]
+
+
+def step_by_step(auth: BasicAuth, header: str) -> tuple:
+    """ (email, password) through the three former steps
+    """
+    token = auth.extract_base64_authorization_header(header)
+    decoded = auth.decode_base64_authorization_header(token)
+    return auth.extract_user_credentials(decoded)
+
+
+def per_call_us(function, rounds: int) -> float:
+    """ Average duration of `function(header)` in microseconds
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for header in HEADERS:
+            function(header)
+    return (time.perf_counter() - start) / (rounds * len(HEADERS)) * 1e6
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    auth = BasicAuth()
+    for header in HEADERS:
+        assert step_by_step(auth, header) == \
+            auth.parse_authorization_header(header), header
+    before = per_call_us(lambda header: step_by_step(auth, header), rounds)
+    after = per_call_us(auth.parse_authorization_header, rounds)
+    print("step by step: {:.2f} us per header".format(before))
+    print("single pass: {:.2f} us per header ({:.1f}x)"
+          .format(after, before / after))
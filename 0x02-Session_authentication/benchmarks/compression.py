@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+""" Data file size, write and load time of each DB_COMPRESSION setting
+
+Usage: python3 -m benchmarks.compression [count ...]
+"""
+import os
+import sys
+import tempfile
+from benchmarks.hydration import make_records, timed
+from models.json_stream import dump_json_object
+from models.user import User
+
+
+SETTINGS = [('none', 6), ('zlib', 1), ('zlib', 6), ('zlib', 9),
+            ('lzma', 0), ('lzma', 6)]
+
+
+if __name__ == "__main__":
+    counts = [int(c) for c in sys.argv[1:]] or [100000, 1000000]
+    for count in counts:
+        print("objects: {}".format(count))
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                with open(".db_User.json", "w") as f:
+                    dump_json_object(((r['id'], r)
+                                      for r in make_records(count)), f)
+                User.load_from_file()
+                plain_size = None
+                for name, level in SETTINGS:
+                    os.environ['DB_COMPRESSION'] = name
+                    os.environ['DB_COMPRESSION_LEVEL'] = str(level)
+                    write = timed(User.save_to_file)
+                    size = os.stat(".db_User.json").st_size
+                    plain_size = plain_size or size
+                    load = User.load_from_file()['seconds']
+                    print("  {} {}: {:.1f} MB ({:.0%}), write {:.3f} s, "
+                          "load {:.3f} s".format(name, level, size / 1e6,
+                                                 size / plain_size,
+                                                 write, load))
+            finally:
+                os.environ.pop('DB_COMPRESSION', None)
+                os.environ.pop('DB_COMPRESSION_LEVEL', None)
+                os.chdir(cwd)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+""" Startup time: bulk hydration against one constructor call per record
+
+Usage: python3 -m benchmarks.hydration [count ...]
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+from models.json_stream import dump_json_object
+from models.user import User
+
+
+def make_records(count: int) -> list:
+    """ `count` user records as written by `to_json(True)`
+    """
+    return [{'id': str(uuid.uuid4()),
+             'created_at': "2024-{:02d}-{:02d}T10:{:02d}:{:02d}".format(
+                 i % 12 + 1, i % 28 + 1, i % 60, (i * 7) % 60),
+             'updated_at': "2024-06-01T12:00:00",
+             'email': "user{}@hbtn.io".format(i),
+             '_password': "e3b0c44298fc1c149afbf4c8996fb924",
+             'first_name': "Bob", 'last_name': "Dylan"}
+            for i in range(count)]
+
+
+def timed(function) -> float:
+    """ Duration of `function()` in seconds
+    """
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    counts = [int(c) for c in sys.argv[1:]] or [100000, 1000000]
+    for count in counts:
+        records = make_records(count)
+        init = timed(lambda: [User(**r) for r in records])
+        bulk = timed(lambda: list(User.from_records(records)))
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                with open(".db_User.json", "w") as f:
+                    dump_json_object(((r['id'], r) for r in records), f)
+                del records
+                stats = User.load_from_file()
+            finally:
+                os.chdir(cwd)
+        print("objects: {}".format(count))
+        print("  User(**record): {:.3f} s".format(init))
+        print("  User.from_records: {:.3f} s ({:.1f}x)"
+              .format(bulk, init / bulk))
+        print("  load_from_file: {:.3f} s, peak RSS {} KB"
+              .format(stats['seconds'], stats['peak_rss_kb']))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+""" Memory per object: slotted User against the former __dict__ layout
+
+Usage: python3 -m benchmarks.memory_layout [count]
+"""
+from datetime import datetime
+import sys
+import tracemalloc
+import uuid
+from models.user import User
+
+
+class DictUser():
+    """ User with the former layout: a __dict__ and two datetimes
+    """
+
+    def __init__(self, **kwargs):
+        """ Initialize like the former Base and User constructors
+        """
+        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.created_at = datetime.utcnow()
+        self.updated_at = datetime.utcnow()
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+
+def bytes_per_object(factory, count: int) -> float:
+    """ Average traced bytes of `count` objects built by `factory`,
+    the id and email strings excluded since both layouts share them
+    """
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    emails = ["user{}@hbtn.io".format(i) for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [factory(id=ids[i], email=emails[i]) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return (after - before) / count
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    legacy = bytes_per_object(DictUser, count)
+    compact = bytes_per_object(User, count)
+    print("objects: {}".format(count))
+    print("__dict__ layout: {:.1f} bytes/object".format(legacy))
+    print("__slots__ layout: {:.1f} bytes/object".format(compact))
+    print("saved: {:.1f}%".format(100 * (legacy - compact) / legacy))
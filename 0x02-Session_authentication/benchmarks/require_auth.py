@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+""" Auth.require_auth: compiled exclusion list against one regex per
+excluded path
+
+Usage: python3 -m benchmarks.require_auth [count ...]
+"""
+import re
+import sys
+import time
+from api.v1.auth.auth import Auth, ExcludedPaths
+
+
+def legacy_require_auth(path: str, excluded_paths: list) -> bool:
+    """ require_auth before the compiled exclusion list
+    """
+    if not path:
+        return True
+    if path and excluded_paths:
+        for exclusion_path in (ep.strip() for ep in excluded_paths):
+            if exclusion_path.endswith('*'):
+                pattern = f'{exclusion_path[:-1]}.*'
+            elif exclusion_path.endswith('/'):
+                pattern = f'{exclusion_path[:-1]}/.*'
+            else:
+                pattern = f'{exclusion_path}/.*'
+            if re.match(pattern, path):
+                return False
+    return True
+
+
+def make_excluded_paths(count: int) -> list:
+    """ `count` excluded paths, a third of each kind
+    """
+    kinds = ["/api/v1/resource{}/", "/api/v1/res{}*", "/api/v1/item{}"]
+    return [kinds[i % 3].format(i) for i in range(count)]
+
+
+def make_paths(count: int) -> list:
+    """ Request paths: excluded ones, matched by each kind, and paths
+    requiring authentication
+    """
+    return ["/api/v1/resource{}/".format(count - 3),
+            "/api/v1/res{}/x".format(count - 2),
+            "/api/v1/item{}/y".format(count - 1),
+            "/api/v1/users", "/api/v1/users/42", "/api/v1/stats/"]
+
+
+def per_call_us(function, paths: list, excluded: list,
+                rounds: int) -> float:
+    """ Average duration of `function(path, excluded)` in microseconds
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for path in paths:
+            function(path, excluded)
+    return (time.perf_counter() - start) / (rounds * len(paths)) * 1e6
+
+
+if __name__ == "__main__":
+    counts = [int(c) for c in sys.argv[1:]] or [5, 50, 500]
+    for count in counts:
+        excluded = make_excluded_paths(count)
+        paths = make_paths(count)
+        auth = Auth()
+        for path in paths:
+            assert auth.require_auth(path, excluded) == \
+                legacy_require_auth(path, excluded), path
+        rounds = max(10, 20000 // count)
+        legacy = per_call_us(legacy_require_auth, paths, excluded, rounds)
+        matcher = ExcludedPaths(excluded)
+        uncached = per_call_us(lambda path, _: matcher._match(path),
+                               paths, excluded, rounds)
+        cached = per_call_us(auth.require_auth, paths, excluded, rounds)
+        print("excluded paths: {}".format(count))
+        print("  regex per path: {:.2f} us".format(legacy))
+        print("  compiled, without cache: {:.2f} us ({:.0f}x)"
+              .format(uncached, legacy / uncached))
+        print("  require_auth with cache: {:.2f} us ({:.0f}x)"
+              .format(cached, legacy / cached))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+""" Store operations of the models at several dataset sizes
+
+Usage: python3 -m benchmarks.store [--sizes N ...] [--output FILE]
+                                   [--compare BASELINE [--results FILE]]
+                                   [--tolerance RATIO] [--repeat N]
+
+Each size runs in its own process on a synthetic User and UserSession
+dataset generated from --seed, with the engine settings of the
+environment (DB_ENGINE, DB_WRITE_MODE...); in the default snapshot
+mode each save rewrites its class, so use DB_WRITE_MODE=log for the
+large sizes. Every operation keeps the best time of --repeat runs,
+then runs once more under tracemalloc for its peak memory: "to_json"
+clears the JSON cache of its objects before each run, "to_json cached"
+warms it up. The results are written as JSON; with --compare, the
+operations slower or bigger than the baseline by more than --tolerance
+are reported and the exit status is 1.
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from models.json_stream import dump_json_object
+from models.user import User
+from models.user_session import UserSession
+
+
+SIZES = [1000, 10000, 100000, 1000000]
+# differences below these are noise
+MIN_SECONDS = 1e-6
+MIN_PEAK_KB = 64
+
+
+def make_dataset(size: int, seed: int) -> tuple:
+    """ `size` user records and as many session records, as written by
+    `to_json(True)`
+    """
+    rng = random.Random(seed)
+
+    def new_id() -> str:
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    users = []
+    sessions = []
+    for i in range(size):
+        created = "2024-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(
+            rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23),
+            rng.randint(0, 59), rng.randint(0, 59))
+        users.append({'id': new_id(), 'created_at': created,
+                      'updated_at': created,
+                      'email': "user{}@hbtn.io".format(i),
+                      '_password': "{:064x}".format(rng.getrandbits(256)),
+                      'first_name': rng.choice(("Bob", "Alice", "Eve")),
+                      'last_name': rng.choice(("Dylan", "Smith", None))})
+        sessions.append({'id': new_id(), 'created_at': created,
+                         'updated_at': created,
+                         'user_id': users[-1]['id'],
+                         'session_id': new_id()})
+    return users, sessions
+
+
+def store_dataset(cls: type, records: list):
+    """ Replace the stored objects of `cls` by `records`
+    """
+    if os.getenv('DB_ENGINE', 'file') == 'sqlite':
+        cls.bulk_save(cls(**record) for record in records)
+        return
+    with open(".db_{}.json".format(cls.__name__), "w") as f:
+        dump_json_object(((r['id'], r) for r in records), f)
+
+
+def operations(users: list, sessions: list, ops: int, saves: int) -> list:
+    """ (name, number of calls, function, setup) of each benchmarked
+    operation, in running order; `setup`, when not None, runs untimed
+    before each run of `function`
+    """
+    rng = random.Random(len(users))
+    user_ids = [r['id'] for r in rng.sample(users, ops)]
+    emails = [r['email'] for r in rng.sample(users, ops)]
+    session_ids = [r['session_id'] for r in rng.sample(sessions, ops)]
+    saved = [0]
+
+    def to_json():
+        for obj_id in user_ids:
+            User.get(obj_id).to_json()
+
+    def clear_json_cache():
+        for obj_id in user_ids:
+            User.get(obj_id)._json_cache = None
+
+    def save():
+        for obj_id in user_ids[:saves]:
+            saved[0] += 1
+            user = User.get(obj_id)
+            user.first_name = "Name{}".format(saved[0])
+            user.save()
+        User.flush()
+
+    def save_new():
+        for obj_id in user_ids[:saves]:
+            saved[0] += 1
+            UserSession(user_id=obj_id,
+                        session_id="session{}".format(saved[0])).save()
+        UserSession.flush()
+
+    return [
+        ('load_from_file', 1, User.load_from_file, None),
+        ('load_from_file UserSession', 1, UserSession.load_from_file,
+         None),
+        ('count', ops, lambda: [User.count() for _ in range(ops)], None),
+        ('get', ops, lambda: [User.get(i) for i in user_ids], None),
+        ('search indexed', ops,
+         lambda: [User.search({'email': e}) for e in emails], None),
+        ('search indexed UserSession', ops,
+         lambda: [UserSession.search({'session_id': s})
+                  for s in session_ids], None),
+        ('search unindexed', 10,
+         lambda: [User.search({'first_name': "Eve"}) for _ in range(10)],
+         None),
+        ('to_json', ops, to_json, clear_json_cache),
+        # the setup is the warm-up
+        ('to_json cached', ops, to_json, to_json),
+        ('save', saves, save, None),
+        ('save new', saves, save_new, None),
+    ]
+
+
+def run_size(size: int, seed: int, ops: int, saves: int,
+             repeat: int) -> list:
+    """ Results of every operation on a dataset of `size` objects
+    """
+    users, sessions = make_dataset(size, seed)
+    ops = min(ops, size)
+    saves = min(saves, size)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        store_dataset(User, users)
+        store_dataset(UserSession, sessions)
+        for name, calls, function, setup in operations(users, sessions,
+                                                       ops, saves):
+            seconds = None
+            for _ in range(repeat):
+                if setup is not None:
+                    setup()
+                start = time.perf_counter()
+                function()
+                elapsed = time.perf_counter() - start
+                if seconds is None or elapsed < seconds:
+                    seconds = elapsed
+            if setup is not None:
+                setup()
+            tracemalloc.start()
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({'size': size, 'operation': name,
+                            'calls': calls, 'seconds': seconds,
+                            'per_call_us': seconds / calls * 1e6,
+                            'peak_kb': peak // 1024})
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """ Messages describing the results worse than the baseline
+    """
+    base = {(r['size'], r['operation']): r for r in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        old = base.get((result['size'], result['operation']))
+        if old is None:
+            continue
+        label = "{} x{}".format(result['operation'], result['size'])
+        if result['per_call_us'] > old['per_call_us'] * (1 + tolerance) \
+                and result['per_call_us'] - old['per_call_us'] > \
+                MIN_SECONDS * 1e6:
+            regressions.append("{}: {:.1f} us per call, baseline {:.1f}"
+                               .format(label, result['per_call_us'],
+                                       old['per_call_us']))
+        if result['peak_kb'] > old['peak_kb'] * (1 + tolerance) and \
+                result['peak_kb'] - old['peak_kb'] > MIN_PEAK_KB:
+            regressions.append("{}: peak {} KB, baseline {} KB"
+                               .format(label, result['peak_kb'],
+                                       old['peak_kb']))
+    return regressions
+
+
+def run(args: argparse.Namespace) -> dict:
+    """ Run every size in a child process and gather the results
+    """
+    results = []
+    for size in args.sizes:
+        print("{} objects...".format(size), file=sys.stderr)
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.store", "--child",
+             str(size), "--seed", str(args.seed), "--ops", str(args.ops),
+             "--saves", str(args.saves), "--repeat", str(args.repeat)],
+            stdout=subprocess.PIPE, check=True).stdout
+        for result in json.loads(output):
+            print("  {operation}: {per_call_us:.1f} us per call, peak "
+                  "{peak_kb} KB".format(**result), file=sys.stderr)
+            results.append(result)
+    return {'date': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {k: v for k, v in os.environ.items()
+                         if k.startswith('DB_')},
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'results': results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python3 -m benchmarks.store",
+        description="Benchmark the store operations of the models")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ops', type=int, default=1000,
+                        help="calls of the per-object operations")
+    parser.add_argument('--saves', type=int, default=20,
+                        help="calls of the save operations")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="timed runs of each operation")
+    parser.add_argument('--output', help="write the results to this file")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="report the regressions against this file")
+    parser.add_argument('--results', help="compare these results to the "
+                        "baseline instead of running the benchmark")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        json.dump(run_size(args.child, args.seed, args.ops, args.saves,
+                           max(1, args.repeat)), sys.stdout)
+        sys.exit(0)
+    if args.results is not None:
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        results = run(args)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif args.results is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression), file=sys.stderr)
+        sys.exit(1 if regressions else 0)
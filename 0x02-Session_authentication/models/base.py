@@ -1,40 +1,263 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import (Callable, ContextManager, TypeVar, List, Iterable,
+                    Iterator, Tuple)
+from models.engine import storage
+from models.engine.file_engine import DATA, INDEXES  # noqa: F401
+import base64
+import itertools
 import json
+import threading
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+
+# timestamps are stored as float seconds since this naive epoch
+_EPOCH = datetime(1970, 1, 1)
+
+# days since _EPOCH of the "%Y-%m-%d" dates parsed by _parse_timestamp
+_DAYS = {}
+_DAYS_MAX = 4096
+
+
+def _parse_timestamp(value: str) -> float:
+    """ Convert a TIMESTAMP_FORMAT string to float seconds since _EPOCH
+
+    The fixed layout is sliced directly and the day count of each date
+    is cached; other layouts go through strptime.
+    """
+    days = _DAYS.get(value[:10])
+    if days is None or len(value) != 19 or value[10] != 'T' or \
+            value[13] != ':' or value[16] != ':':
+        dt = datetime.strptime(value, TIMESTAMP_FORMAT)
+        if len(_DAYS) >= _DAYS_MAX:
+            _DAYS.clear()
+        _DAYS[value[:10]] = (dt - _EPOCH).days
+        return (dt - _EPOCH).total_seconds()
+    hours = int(value[11:13])
+    minutes = int(value[14:16])
+    seconds = int(value[17:19])
+    if not (0 <= hours <= 23 and 0 <= minutes <= 59 and 0 <= seconds <= 59):
+        raise ValueError("Invalid timestamp: {!r}".format(value))
+    return float(days * 86400 + hours * 3600 + minutes * 60 + seconds)
+
+
+def _to_timestamp(value) -> float:
+    """ Convert a datetime, a TIMESTAMP_FORMAT string or a number
+    to float seconds since _EPOCH
+    """
+    if type(value) is str:
+        return _parse_timestamp(value)
+    if isinstance(value, datetime):
+        return (value - _EPOCH).total_seconds()
+    return float(value)
+
+
+# value of the attributes not set yet
+_UNSET = object()
+# `_changed` of an object never stored: shared, so that a new object
+# does not hold a set of all its fields
+_NEW = object()
+
+
+class _BatchUndo(threading.local):
+    """ Former attribute values of the objects changed in the batch of
+    the current thread, by object ID; None outside of a batch
+    """
+
+    undo = None
+
+
+_batch = _BatchUndo()
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, str]:
+    """ Decode a cursor made by Base.cursor into its (timestamp, ID) key,
+    raise ValueError if it is invalid
+    """
+    try:
+        ts, obj_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(ts), str(obj_id)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor: {!r}".format(cursor))
 
 
 class Base():
     """ Base class
+
+    Subclasses can list attribute names in `indexed_attributes`: an
+    equality index is kept for each of them and used by `search`.
+    `ordered_attributes` are kept sorted: `_created_ts` gives the order
+    of `iter_search`, and both timestamps serve the time-window queries
+    `created_between` and `updated_between`.
+
+    Persistence is delegated to the storage engine selected by DB_ENGINE
+    (see models.engine).
+
+    Instances are slotted: subclasses declare their attributes in
+    `__slots__`. `created_at` and `updated_at` are stored as floats and
+    converted to datetime on access.
+
+    Writes to the stored attributes are tracked in `_changed`: `save`
+    does nothing for an unchanged object and hands the changed fields
+    to the storage. A new object has the `_NEW` marker in `_changed`
+    and is stored whole. The same writes drop the cached result of `to_json()`.
     """
 
+    __slots__ = ('id', '_created_ts', '_updated_ts', '_changed',
+                 '_json_cache')
+
+    indexed_attributes = ()
+    ordered_attributes = ('_created_ts', '_updated_ts')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
-
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = kwargs['created_at']
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = kwargs['updated_at']
         else:
             self.updated_at = datetime.utcnow()
 
+    @classmethod
+    def from_records(cls, records: Iterable[dict]
+                     ) -> Iterator[TypeVar('Base')]:
+        """ Build objects from records made by `to_json(True)`
+
+        Bulk hydration for trusted records: the slots are filled
+        directly, without __init__ nor the index hooks, and missing
+        attributes are None. Classes whose instances have a __dict__
+        go through __init__. The objects are unchanged.
+        """
+        if cls.__dictoffset__ != 0:
+            for record in records:
+                obj = cls(**record)
+                obj._changed = None
+                yield obj
+            return
+        new = object.__new__
+        set_id = Base.id.__set__
+        set_created = Base._created_ts.__set__
+        set_updated = Base._updated_ts.__set__
+        setters = [(name, getattr(cls, name).__set__)
+                   for name in cls._json_fields()[3:]]
+        parse = _parse_timestamp
+        for record in records:
+            obj = new(cls)
+            set_id(obj, record['id'])
+            created_at = record.get('created_at')
+            updated_at = record.get('updated_at')
+            if type(created_at) is str and type(updated_at) is str:
+                set_created(obj, parse(created_at))
+                set_updated(obj, parse(updated_at))
+            else:
+                obj.created_at = created_at or datetime.utcnow()
+                obj.updated_at = updated_at or datetime.utcnow()
+            for name, setter in setters:
+                setter(obj, record.get(name))
+            yield obj
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, record the change and keep the indexes of
+        stored objects in sync
+        """
+        cls = self.__class__
+        fields = cls.__dict__.get('_tracked')
+        if fields is None:
+            fields = cls._tracked_fields()
+        field = fields.get(name)
+        if field is None and (cls.__dictoffset__ == 0 or
+                              name == '_changed' or hasattr(cls, name)):
+            super().__setattr__(name, value)
+            return
+        old = getattr(self, name, _UNSET)
+        super().__setattr__(name, value)
+        if old is not _UNSET and old == value:
+            return
+        changed = getattr(self, '_changed', _UNSET)
+        undo = _batch.undo
+        if undo is not None and old is not _UNSET:
+            entry = undo.get(id(self))
+            if entry is None:
+                undo[id(self)] = (self, {name: old},
+                                  set(changed) if type(changed) is set
+                                  else changed)
+            else:
+                entry[1].setdefault(name, old)
+        if changed is _UNSET and old is _UNSET:
+            # first write of a new object
+            changed = _NEW
+            super().__setattr__('_changed', changed)
+        elif changed is None or changed is _UNSET:
+            changed = set()
+            super().__setattr__('_changed', changed)
+        if changed is not _NEW:
+            changed.add(field or name)
+        super().__setattr__('_json_cache', None)
+        if name in cls.indexed_attributes or name in cls.ordered_attributes:
+            storage().reindex(self, name, None if old is _UNSET else old,
+                              value)
+
+    @property
+    def created_at(self) -> datetime:
+        """ Creation datetime
+        """
+        return _EPOCH + timedelta(seconds=self._created_ts)
+
+    @created_at.setter
+    def created_at(self, value):
+        """ Set the creation datetime
+        """
+        self._created_ts = _to_timestamp(value)
+
+    @property
+    def updated_at(self) -> datetime:
+        """ Last update datetime
+        """
+        return _EPOCH + timedelta(seconds=self._updated_ts)
+
+    @updated_at.setter
+    def updated_at(self, value):
+        """ Set the last update datetime
+        """
+        self._updated_ts = _to_timestamp(value)
+
+    @classmethod
+    def _json_fields(cls) -> tuple:
+        """ Names of the attributes returned by to_json, in order
+        """
+        fields = cls.__dict__.get('_fields')
+        if fields is None:
+            fields = ['id', 'created_at', 'updated_at']
+            for klass in reversed(cls.__mro__):
+                for name in klass.__dict__.get('__slots__', ()):
+                    if name not in fields and name not in Base.__slots__:
+                        fields.append(name)
+            fields = tuple(fields)
+            cls._fields = fields
+        return fields
+
+    @classmethod
+    def _tracked_fields(cls) -> dict:
+        """ Names of the stored slots mapped to their to_json key
+        """
+        tracked = cls.__dict__.get('_tracked')
+        if tracked is None:
+            tracked = {name: name for name in cls._json_fields()}
+            del tracked['created_at'], tracked['updated_at']
+            tracked['_created_ts'] = 'created_at'
+            tracked['_updated_ts'] = 'updated_at'
+            cls._tracked = tracked
+        return tracked
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -47,8 +270,45 @@ class Base():
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
+        if not for_serialization:
+            return dict(self._json()[0])
+        return self._to_json(for_serialization)
+
+    def to_json_bytes(self) -> bytes:
+        """ `to_json()` encoded like jsonify does: sorted keys and
+        compact separators
+        """
+        return self._json()[1]
+
+    def _json(self) -> tuple:
+        """ Cached (`to_json()`, encoded `to_json()`) pair
+        """
+        cache = getattr(self, '_json_cache', None)
+        if cache is not None and cache is not _UNSET:
+            return cache
+        # _UNSET marks the encoding in progress: a write meanwhile
+        # replaces it with None and the result is not kept
+        self._json_cache = _UNSET
+        obj_json = self._to_json()
+        cache = (obj_json, json.dumps(obj_json, sort_keys=True,
+                                      separators=(',', ':')).encode())
+        if getattr(self, '_json_cache', None) is _UNSET:
+            self._json_cache = cache
+        return cache
+
+    def _to_json(self, for_serialization: bool = False) -> dict:
+        """ Build the JSON dictionary of `to_json`
+        """
         result = {}
-        for key, value in self.__dict__.items():
+        items = []
+        for key in self.__class__._json_fields():
+            try:
+                items.append((key, getattr(self, key)))
+            except AttributeError:
+                continue
+        if hasattr(self, '__dict__'):
+            items.extend(self.__dict__.items())
+        for key, value in items:
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -58,80 +318,175 @@ class Base():
         return result
 
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
-        """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+    def load_from_file(cls, progress: Callable[[int], None] = None,
+                       progress_every: int = 10000) -> dict:
+        """ Load all objects from the storage
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        `progress` is called with the number of loaded objects every
+        `progress_every` objects. Return the number of objects, the
+        duration and the peak RSS (KB).
+        """
+        return storage().load(cls, progress, progress_every)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        storage().persist_all(cls)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def compact(cls, force: bool = False) -> dict:
+        """ Rewrite the storage of the class without its obsolete data,
+        if `force` or if enough of it accumulated (see
+        models.engine.file_engine)
+
+        Return whether it was compacted, the sizes before and after,
+        the bytes reclaimed and the duration.
+        """
+        return storage().compact(cls, force)
+
+    @classmethod
+    def flush(cls):
+        """ Write every pending mutation to the storage
+        """
+        storage().flush()
 
     def save(self):
-        """ Save current object
+        """ Save current object if it changed since it was loaded or saved
         """
-        s_class = self.__class__.__name__
+        if not getattr(self, '_changed', None):
+            return
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        changed = self._changed
+        self._changed = None
+        try:
+            storage().save(self, None if changed is _NEW or 'id' in changed
+                           else changed)
+        except BaseException:
+            self._changed = changed
+            raise
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        storage().remove(self)
+        self._changed = _NEW
+
+    @staticmethod
+    @contextmanager
+    def batch() -> ContextManager:
+        """ Context manager grouping the saves and removals of the current
+        thread: each class is persisted once at the end of the block, and
+        nothing is persisted if the block raises an exception
+
+        On error, the attributes changed in the block also get back their
+        former values. The classes are then written one after the other:
+        with the file engines, a failed write leaves the classes written
+        before it with the changes of the block.
+        """
+        if _batch.undo is not None:
+            yield
+            return
+        undo = _batch.undo = {}
+        try:
+            with storage().batch():
+                try:
+                    yield
+                except BaseException:
+                    _batch.undo = None
+                    for obj, olds, changed in reversed(list(undo.values())):
+                        for name, old in olds.items():
+                            setattr(obj, name, old)
+                        obj._changed = None if changed is _UNSET else changed
+                    raise
+        finally:
+            _batch.undo = None
+
+    @classmethod
+    def bulk_save(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save all `objs` in one batch
+        """
+        with cls.batch():
+            for obj in objs:
+                obj.save()
+
+    @classmethod
+    def bulk_remove(cls, objs: Iterable[TypeVar('Base')]):
+        """ Remove all `objs` in one batch
+        """
+        objs = list(objs)
+        with cls.batch():
+            storage().remove_all(objs)
+        for obj in objs:
+            obj._changed = _NEW
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return storage().count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
         """ Return all objects
         """
-        return cls.search()
+        return storage().all(cls)
 
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return storage().get(cls, id)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return storage().search(cls, attributes)
+
+    @classmethod
+    def iter_search(cls, attributes: dict = {}, cursor: str = None,
+                    limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Lazily yield the objects with matching attributes, ordered by
+        created_at then id, starting after `cursor` (see Base.cursor)
+        and stopping after `limit` objects
+        """
+        after = None
+        if cursor is not None:
+            after = _decode_cursor(cursor)
+        objs = storage().iter_search(cls, attributes, after)
+        if limit is not None:
+            objs = itertools.islice(objs, limit)
+        return objs
+
+    def cursor(self) -> str:
+        """ Opaque cursor for iter_search to resume after this object
+        """
+        key = json.dumps([self._created_ts, self.id])
+        return base64.urlsafe_b64encode(key.encode()).decode()
+
+    @classmethod
+    def created_between(cls, start: datetime = None,
+                        end: datetime = None,
+                        limit: int = None) -> List[TypeVar('Base')]:
+        """ Objects created from `start` (included) to `end` (excluded),
+        ordered by created_at, at most `limit` of them; a None bound is
+        unbounded
+        """
+        return storage().range_search(
+            cls, '_created_ts',
+            None if start is None else _to_timestamp(start),
+            None if end is None else _to_timestamp(end), limit)
+
+    @classmethod
+    def updated_between(cls, start: datetime = None,
+                        end: datetime = None,
+                        limit: int = None) -> List[TypeVar('Base')]:
+        """ Objects updated from `start` (included) to `end` (excluded),
+        ordered by updated_at, at most `limit` of them; a None bound is
+        unbounded
+        """
+        return storage().range_search(
+            cls, '_updated_ts',
+            None if start is None else _to_timestamp(start),
+            None if end is None else _to_timestamp(end), limit)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+""" Compaction of the stored classes
+
+Usage: python3 -m models.compact [--force] [Class ...]
+
+Without class names, every model class is compacted.
+"""
+import argparse
+from models.user import User
+from models.user_session import UserSession
+
+
+CLASSES = {cls.__name__: cls for cls in (User, UserSession)}
+
+
+def main(argv: list = None):
+    """ Compact the classes named in `argv` and print a report
+    """
+    parser = argparse.ArgumentParser(prog="python3 -m models.compact")
+    parser.add_argument('classes', nargs='*', metavar='Class',
+                        help="one of: " + ", ".join(CLASSES))
+    parser.add_argument('--force', action='store_true',
+                        help="compact even below the thresholds")
+    args = parser.parse_args(argv)
+    for name in args.classes:
+        if name not in CLASSES:
+            parser.error("unknown class: {}".format(name))
+    for name in args.classes or CLASSES:
+        stats = CLASSES[name].compact(args.force)
+        if not stats['compacted']:
+            print("{}: below the thresholds ({} bytes)"
+                  .format(name, stats['bytes_before']))
+            continue
+        print("{}: {} -> {} bytes, {} reclaimed in {:.3f} s"
+              .format(name, stats['bytes_before'], stats['bytes_after'],
+                      stats['bytes_reclaimed'], stats['seconds']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+""" Storage engines of the models
+
+The engine is selected by the DB_ENGINE environment variable:
+  - file (default): objects in memory, persisted to .db_<Class>.json
+  - sqlite: one table per class in DB_SQLITE_PATH (.db.sqlite3)
+  - lazy: the files of the file engine, objects decoded on demand
+"""
+from os import getenv
+import threading
+from models.engine.storage_engine import StorageEngine
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def storage() -> StorageEngine:
+    """ Return the storage engine selected by DB_ENGINE
+    """
+    name = getenv('DB_ENGINE', 'file')
+    engine = _engines.get(name)
+    if engine is not None:
+        return engine
+    with _engines_lock:
+        if name not in _engines:
+            if name == 'file':
+                from models.engine.file_engine import FileEngine
+                _engines[name] = FileEngine()
+            elif name == 'lazy':
+                from models.engine.lazy_engine import LazyFileEngine
+                _engines[name] = LazyFileEngine()
+            elif name == 'sqlite':
+                from models.engine.sqlite_engine import SQLiteEngine
+                db_path = getenv('DB_SQLITE_PATH', '.db.sqlite3')
+                _engines[name] = SQLiteEngine(db_path)
+            else:
+                raise ValueError("Unknown DB_ENGINE: {}".format(name))
+        return _engines[name]
@@ -0,0 +1,1140 @@
+#!/usr/bin/env python3
+""" In-memory storage engine persisted to JSON files
+
+Objects live in DATA and each class is written to .db_<Class>.json.
+With DB_WRITE_MODE=log, mutations are appended to .db_<Class>.log and
+replayed on top of the snapshot at load time: an update of a stored
+object only logs its changed fields. Once the log reaches
+DB_COMPACT_MIN_BYTES and DB_COMPACT_RATIO times the snapshot size, it
+is compacted: a new snapshot is written and the log emptied (see also
+`python3 -m models.compact`). With DB_FLUSH_INTERVAL, writes are
+delegated to a background thread.
+
+Each class has a readers-writer lock guarding its objects and indexes,
+and a file lock serializing its writers and disk writes. Snapshots are
+written to a temporary file which then replaces the data file.
+
+With DB_SHARDS=N (N > 1), each class is split by ID hash across the
+files .db_<Class>.<k>.json and .db_<Class>.<k>.log, k < N: a mutation
+only rewrites its shard, and the shards are loaded by a thread pool of
+DB_LOAD_WORKERS threads. `python3 -m models.reshard` migrates existing
+files to another shard count.
+
+With DB_COMPRESSION=zlib (gzip stream) or lzma (xz stream), the data
+files are compressed at level DB_COMPRESSION_LEVEL while they are
+written; log files stay plain text. The format of a data file is read
+from its first bytes, so changing DB_COMPRESSION takes effect at the
+next snapshot of each class.
+
+With DB_COHERENT=1, several processes can share the files: writes hold
+an exclusive flock on .db_<Class>.lock, and every operation first
+compares the stat of the data files with the one of the last load, to
+reload the class only when another process wrote it. Write-behind is
+disabled in this mode.
+
+Inside `batch()`, a thread keeps the file locks of the classes it
+changes until the end of the block, where each class is persisted once.
+Batches run one at a time (across processes in coherent mode, through
+.db_batch.lock), so that two batches never wait for each other's class
+locks. If the block raises, the objects saved and removed in it are put
+back in DATA and nothing of the block is written. The guarantee is per
+class: if writing a class fails at the end of the block, the classes
+written before it keep the changes of the block, and the others are
+reloaded from their files.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import IO, Callable, Iterable, Iterator, List, Tuple, TypeVar
+from os import getenv, path
+from models.engine.locks import RWLock
+from models.engine.sorted_index import SortedIndex
+from models.engine.storage_engine import StorageEngine
+from models.json_stream import dump_json_object, iter_json_object
+import atexit
+import gzip
+import io
+import json
+import lzma
+import os
+import threading
+import time
+import zlib
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+DATA = {}
+INDEXES = {}
+ITER_CHUNK_SIZE = 256
+
+
+def _log_mode() -> bool:
+    """ True when mutations are appended to the class log file
+    (DB_WRITE_MODE=log) instead of rewriting the whole snapshot
+    """
+    return getenv('DB_WRITE_MODE', 'snapshot') == 'log'
+
+
+def _shard_count() -> int:
+    """ Number of shards of each class (DB_SHARDS)
+    """
+    try:
+        return max(1, int(getenv('DB_SHARDS', '1')))
+    except ValueError:
+        return 1
+
+
+def _shard(obj_id: str, count: int) -> int:
+    """ Shard of the object `obj_id` among `count` shards
+    """
+    if count == 1:
+        return 0
+    return zlib.crc32(obj_id.encode()) % count
+
+
+def _path(s_class: str, shard: int, ext: str, count: int = None) -> str:
+    """ Path of the data ('json') or log ('log') file of a shard of
+    `s_class`, .db_<Class>.<ext> when the class has a single shard
+    """
+    if count is None:
+        count = _shard_count()
+    if count == 1:
+        return ".db_{}.{}".format(s_class, ext)
+    return ".db_{}.{}.{}".format(s_class, shard, ext)
+
+
+def _shard_files(s_class: str) -> dict:
+    """ Data and log files of `s_class` on disk, by shard (None for the
+    unsharded files)
+    """
+    prefix = ".db_{}.".format(s_class)
+    files = {}
+    for name in os.listdir('.'):
+        if not name.startswith(prefix):
+            continue
+        parts = name[len(prefix):].split('.')
+        if parts[-1] not in ('json', 'log'):
+            continue
+        if len(parts) == 1:
+            files.setdefault(None, []).append(name)
+        elif len(parts) == 2 and parts[0].isdigit():
+            files.setdefault(int(parts[0]), []).append(name)
+    return files
+
+
+def _check_layout(s_class: str, count: int):
+    """ Raise ValueError if the files of `s_class` were written with
+    another number of shards
+    """
+    for shard, names in _shard_files(s_class).items():
+        if shard is None:
+            stale = count > 1 and any(_file_size(name) > 0
+                                      for name in names)
+        else:
+            stale = count == 1 or shard >= count
+        if stale:
+            raise ValueError("The files of {} do not match DB_SHARDS={}: "
+                             "run python3 -m models.reshard {}"
+                             .format(s_class, count, count))
+
+
+def reshard(s_class: str, count: int) -> dict:
+    """ Rewrite the files of `s_class` in `count` shards, whatever their
+    current layout, and remove the former files
+
+    The records are moved without building objects. The former files
+    are removed once every new one is written: run it while the
+    application is stopped. Return the number of objects and files.
+    """
+    files = _shard_files(s_class)
+    records = {}
+    for shard in sorted(files, key=lambda shard: -1 if shard is None
+                        else shard):
+        names = sorted(files[shard])
+        for name in names:
+            if name.endswith('.json'):
+                with _open_data(name) as f:
+                    records.update(iter_json_object(f))
+        for name in names:
+            if not name.endswith('.log'):
+                continue
+            for record in _read_log(name):
+                if record['op'] == 'save':
+                    records[record['id']] = record['obj']
+                elif record['op'] == 'update':
+                    if record['id'] in records:
+                        records[record['id']].update(record['fields'])
+                elif record['op'] == 'remove':
+                    records.pop(record['id'], None)
+    shards = [[] for _ in range(count)]
+    for obj_id, record in records.items():
+        shards[_shard(obj_id, count)].append((obj_id, record))
+    new_files = set()
+    for shard, items in enumerate(shards):
+        file_path = _path(s_class, shard, 'json', count)
+        _write_data(file_path, lambda f: dump_json_object(items, f))
+        new_files.add(file_path)
+    for names in files.values():
+        for name in names:
+            if name not in new_files:
+                os.remove(name)
+    return {'objects': len(records), 'files': len(new_files)}
+
+
+def _append_log(s_class: str, records: List[dict]):
+    """ Append mutation records to the log files of `s_class`
+    """
+    count = _shard_count()
+    lines = {}
+    for record in records:
+        lines.setdefault(_shard(record['id'], count), []).append(
+            json.dumps(record) + "\n")
+    for shard, shard_lines in lines.items():
+        with open(_path(s_class, shard, 'log', count), 'a') as f:
+            f.write("".join(shard_lines))
+
+
+def _read_log(log_path: str) -> Iterator[dict]:
+    """ Records of the log file `log_path`, in order
+
+    A last line without its newline is the torn record of an interrupted
+    write: it is cut off the file once read, so that the next append
+    starts on a new line. Other lines that fail to parse are skipped.
+    """
+    end = 0
+    with open(log_path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            end += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            yield record
+        torn = f.tell() > end
+    if torn:
+        os.truncate(log_path, end)
+
+
+def _coherent() -> bool:
+    """ True when the files are shared with other processes
+    (DB_COHERENT=1)
+    """
+    return getenv('DB_COHERENT', '0') == '1'
+
+
+def _stamp(s_class: str) -> tuple:
+    """ Identity, modification time and size of the files of `s_class`
+    """
+    stamp = []
+    count = _shard_count()
+    for shard in range(count):
+        for ext in ('json', 'log'):
+            try:
+                st = os.stat(_path(s_class, shard, ext, count))
+            except OSError:
+                stamp.append(None)
+                continue
+            stamp.append((st.st_ino, st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+
+def _flush_interval() -> float:
+    """ Seconds between two background flushes (DB_FLUSH_INTERVAL),
+    0 to write synchronously in the calling thread
+    """
+    try:
+        return float(getenv('DB_FLUSH_INTERVAL', '0'))
+    except ValueError:
+        return 0
+
+
+def _flush_max_dirty() -> int:
+    """ Number of pending mutations that triggers an early flush
+    (DB_FLUSH_MAX_DIRTY)
+    """
+    try:
+        return int(getenv('DB_FLUSH_MAX_DIRTY', '1000'))
+    except ValueError:
+        return 1000
+
+
+def _load_workers() -> int:
+    """ Number of threads loading the shards of a class
+    (DB_LOAD_WORKERS, default: number of CPUs)
+    """
+    try:
+        return max(1, int(getenv('DB_LOAD_WORKERS', str(os.cpu_count()))))
+    except ValueError:
+        return 1
+
+
+def _compact_min_bytes() -> int:
+    """ Log size from which it is compacted (DB_COMPACT_MIN_BYTES)
+    """
+    try:
+        return int(getenv('DB_COMPACT_MIN_BYTES', str(1 << 20)))
+    except ValueError:
+        return 1 << 20
+
+
+def _compact_ratio() -> float:
+    """ Log to snapshot size ratio from which the log is compacted
+    (DB_COMPACT_RATIO)
+    """
+    try:
+        return float(getenv('DB_COMPACT_RATIO', '1'))
+    except ValueError:
+        return 1.0
+
+
+def _compression() -> Tuple[str, int]:
+    """ Compression of the data files written from now on
+    (DB_COMPRESSION: none, zlib or lzma) and its level
+    (DB_COMPRESSION_LEVEL, 0 to 9, default 6)
+    """
+    name = getenv('DB_COMPRESSION', 'none')
+    if name not in ('zlib', 'lzma'):
+        name = 'none'
+    try:
+        level = min(9, max(0, int(getenv('DB_COMPRESSION_LEVEL', '6'))))
+    except ValueError:
+        level = 6
+    return name, level
+
+
+@contextmanager
+def _open_data(file_path: str) -> Iterator[IO[str]]:
+    """ Open a data file for reading as text, decompressing it as a
+    stream if it starts with a gzip or xz header
+    """
+    with open(file_path, 'rb') as raw:
+        magic = raw.read(6)
+        raw.seek(0)
+        if magic[:2] == b"\x1f\x8b":
+            stream = gzip.GzipFile(fileobj=raw, mode='rb')
+        elif magic == b"\xfd7zXZ\x00":
+            stream = lzma.LZMAFile(raw, 'rb')
+        else:
+            stream = raw
+        with io.TextIOWrapper(stream, encoding='utf-8') as f:
+            yield f
+
+
+def _write_data(file_path: str, write: Callable):
+    """ Call `write` on a text stream replacing the data file
+    `file_path`, compressed according to DB_COMPRESSION
+    """
+    name, level = _compression()
+    if name == 'none':
+        _write_atomic(file_path, write)
+        return
+
+    def write_compressed(raw):
+        if name == 'zlib':
+            stream = gzip.GzipFile(fileobj=raw, mode='wb',
+                                   compresslevel=level, mtime=0)
+        else:
+            stream = lzma.LZMAFile(raw, 'wb', preset=level)
+        # closing the wrappers ends the compressed stream, not `raw`
+        with io.TextIOWrapper(stream, encoding='utf-8') as f:
+            write(f)
+
+    _write_atomic(file_path, write_compressed, 'wb')
+
+
+def _file_size(file_path: str) -> int:
+    """ Size of a file, 0 if it does not exist
+    """
+    try:
+        return os.stat(file_path).st_size
+    except OSError:
+        return 0
+
+
+def _index_key(value):
+    """ Return `value` if it can be used as an index key, else None
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return value
+
+
+def _indexed(cls: type) -> tuple:
+    """ Attributes of `cls` with an equality or an ordered index
+    """
+    return cls.indexed_attributes + cls.ordered_attributes
+
+
+def _index_add(index, value, obj_id: str):
+    """ Register `obj_id` under `value` in `index`
+    """
+    if isinstance(index, SortedIndex):
+        index.add(value, obj_id)
+        return
+    if _index_key(value) is None:
+        return
+    index.setdefault(value, {})[obj_id] = None
+
+
+def _index_discard(index, value, obj_id: str):
+    """ Unregister `obj_id` from `value` in `index`
+    """
+    if isinstance(index, SortedIndex):
+        index.discard(value, obj_id)
+        return
+    if _index_key(value) is None:
+        return
+    bucket = index.get(value)
+    if bucket is None:
+        return
+    bucket.pop(obj_id, None)
+    if len(bucket) == 0:
+        del index[value]
+
+
+def _index_discard_all(index, pairs: List[Tuple]):
+    """ Unregister the (value, ID) `pairs` from `index`
+    """
+    if isinstance(index, SortedIndex):
+        index.discard_all(pairs)
+        return
+    for value, obj_id in pairs:
+        _index_discard(index, value, obj_id)
+
+
+def _write_atomic(file_path: str, write: Callable, mode: str = 'w'):
+    """ Call `write` on a temporary file opened with `mode`, then move it
+    over `file_path`
+    """
+    tmp_path = "{}.{}.{}.tmp".format(file_path, os.getpid(),
+                                     threading.get_ident())
+    try:
+        with open(tmp_path, mode) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    finally:
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class _Batch():
+    """ Mutations of one class in the batch of a thread: the records to
+    persist, the former stored object of each ID to put back on error,
+    and the shards of the pending write-behind snapshot taken over
+    """
+
+    def __init__(self, cls: type):
+        """ Initialize an empty batch of `cls`
+        """
+        self.cls = cls
+        self.records = []
+        self.undo = []
+        self.shards = set()
+
+
+class FileEngine(StorageEngine):
+    """ Storage engine keeping every object in DATA
+    """
+
+    def __init__(self):
+        """ Initialize the locks and the write-behind state
+        """
+        self._locks = {}
+        self._file_locks = {}
+        self._locks_lock = threading.Lock()
+        # coherent mode: stamps of the last load, flock depth per class
+        self._stamps = {}
+        self._flocks = {}
+        # IDs of each shard by class, when there are several shards
+        self._shard_ids = {}
+        # classes waiting for a flush, their shards to rewrite and their
+        # pending log records
+        self._dirty = {}
+        self._dirty_shards = {}
+        self._pending_log = {}
+        self._dirty_count = 0
+        self._dirty_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_wakeup = threading.Event()
+        self._flusher = None
+        # batch of the current thread: locks and _Batch per class, and
+        # lock taken by a batch before any class lock
+        self._batches = threading.local()
+        self._batch_lock = threading.Lock()
+
+    def _lock(self, cls: type) -> RWLock:
+        """ Readers-writer lock of the objects of `cls`
+        """
+        lock = self._locks.get(cls.__name__)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._locks.setdefault(cls.__name__, RWLock())
+        return lock
+
+    def _file_lock(self, cls: type) -> threading.RLock:
+        """ Lock serializing the writers and the files of `cls`
+        """
+        lock = self._file_locks.get(cls.__name__)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._file_locks.setdefault(cls.__name__,
+                                                   threading.RLock())
+        return lock
+
+    def _process_lock(self, cls: type, exclusive: bool = True):
+        """ Hold the flock of `cls` in coherent mode, file lock held
+
+        Nested acquisitions reuse the outer one.
+        """
+        return self._flock(cls.__name__, exclusive)
+
+    @contextmanager
+    def _flock(self, s_class: str, exclusive: bool = True):
+        """ Hold the flock of .db_<s_class>.lock in coherent mode
+        """
+        if not _coherent() or fcntl is None or s_class in self._flocks:
+            yield
+            return
+        with open(".db_{}.lock".format(s_class), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._flocks[s_class] = f
+            try:
+                yield
+            finally:
+                del self._flocks[s_class]
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sync(self, cls: type):
+        """ Reload `cls` if another process changed its files
+        """
+        if not _coherent():
+            return
+        s_class = cls.__name__
+        if self._stamps.get(s_class) != _stamp(s_class):
+            self.load(cls)
+
+    def _objects(self, cls: type) -> dict:
+        """ Stored objects of `cls` by ID
+        """
+        return DATA.setdefault(cls.__name__, {})
+
+    def load(self, cls: type, progress: Callable[[int], None] = None,
+             progress_every: int = 10000) -> dict:
+        """ Load all objects from file, then replay the mutation log
+
+        The file is parsed one object at a time. `progress` is called
+        with the number of loaded objects every `progress_every` objects.
+        Return the number of objects, the duration and the peak RSS (KB).
+        """
+        s_class = cls.__name__
+        if s_class in self._dirty:
+            self.flush()
+        start = time.monotonic()
+        count = _shard_count()
+        _check_layout(s_class, count)
+        with self._file_lock(cls), self._process_lock(cls, False):
+            if count == 1:
+                objs = self._load_shard(cls, 0, progress, progress_every)
+                shard_ids = None
+            else:
+                workers = min(count, _load_workers())
+                with ThreadPoolExecutor(workers) as pool:
+                    shards = list(pool.map(
+                        lambda shard: self._load_shard(cls, shard),
+                        range(count)))
+                objs = {}
+                for shard in shards:
+                    objs.update(shard)
+                    if progress is not None:
+                        progress(len(objs))
+                shard_ids = [dict.fromkeys(shard) for shard in shards]
+                del shards
+            # after the replay, which may cut a torn record off a log
+            stamp = _stamp(s_class)
+            indexes = self._build_indexes(cls, objs)
+            with self._lock(cls).write():
+                DATA[s_class] = objs
+                INDEXES[s_class] = indexes
+            self._shard_ids[s_class] = shard_ids
+            self._stamps[s_class] = stamp
+        if progress is not None:
+            progress(len(objs))
+        peak_rss = None
+        if resource is not None:
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'objects': len(objs),
+                'seconds': time.monotonic() - start,
+                'peak_rss_kb': peak_rss}
+
+    def _load_shard(self, cls: type, shard: int,
+                    progress: Callable[[int], None] = None,
+                    progress_every: int = 10000) -> dict:
+        """ Objects of one shard of `cls` by ID: its data file, then the
+        records of its log
+        """
+        file_path = _path(cls.__name__, shard, 'json')
+        objs = {}
+        if path.exists(file_path):
+            with _open_data(file_path) as f:
+                records = (obj_json for _, obj_json
+                           in iter_json_object(f))
+                for obj in cls.from_records(records):
+                    objs[obj.id] = obj
+                    if progress is not None and \
+                            len(objs) % progress_every == 0:
+                        progress(len(objs))
+        self._replay_log(cls, objs, _path(cls.__name__, shard, 'log'))
+        return objs
+
+    def _replay_log(self, cls: type, objs: dict, log_path: str):
+        """ Apply the records of the log file `log_path` on top of `objs`
+        """
+        if not path.exists(log_path):
+            return
+
+        for record in _read_log(log_path):
+            if record['op'] == 'save':
+                objs[record['id']] = next(cls.from_records([record['obj']]))
+            elif record['op'] == 'update':
+                obj = objs.get(record['id'])
+                if obj is None:
+                    continue
+                for key, value in record['fields'].items():
+                    setattr(obj, key, value)
+                obj._changed = None
+            elif record['op'] == 'remove':
+                objs.pop(record['id'], None)
+
+    def _build_indexes(self, cls: type, objs: dict) -> dict:
+        """ Build the indexes of `cls` over `objs`
+        """
+        indexes = {attr: {} for attr in cls.indexed_attributes}
+        for obj_id, obj in objs.items():
+            for attr in cls.indexed_attributes:
+                _index_add(indexes[attr], getattr(obj, attr, None), obj_id)
+        for attr in cls.ordered_attributes:
+            indexes[attr] = SortedIndex(
+                (getattr(obj, attr), obj_id) for obj_id, obj in objs.items()
+                if getattr(obj, attr, None) is not None)
+        return indexes
+
+    def persist_all(self, cls: type, shards: Iterable[int] = None):
+        """ Save all objects to file, or only the objects of `shards`
+
+        The snapshot contains every mutation, so the log is emptied.
+        """
+        s_class = cls.__name__
+        count = _shard_count()
+        with self._file_lock(cls), self._process_lock(cls):
+            self._sync(cls)
+            shard_ids = self._shard_ids_of(cls)
+            for shard in (range(count) if shards is None else shards):
+                with self._lock(cls).read():
+                    objs = self._objects(cls)
+                    records = [(obj_id, objs[obj_id].to_json(True))
+                               for obj_id in shard_ids[shard]]
+                _write_data(_path(s_class, shard, 'json', count),
+                            lambda f: dump_json_object(records, f))
+                log_path = _path(s_class, shard, 'log', count)
+                if path.exists(log_path):
+                    open(log_path, 'w').close()
+            self._stamps[s_class] = _stamp(s_class)
+
+    def _shard_ids_of(self, cls: type) -> List[dict]:
+        """ IDs of `cls` by shard, file lock held
+        """
+        count = _shard_count()
+        if count == 1:
+            return [self._objects(cls)]
+        shard_ids = self._shard_ids.get(cls.__name__)
+        if shard_ids is None or len(shard_ids) != count:
+            shard_ids = [{} for _ in range(count)]
+            with self._lock(cls).read():
+                for obj_id in self._objects(cls):
+                    shard_ids[_shard(obj_id, count)][obj_id] = None
+            self._shard_ids[cls.__name__] = shard_ids
+        return shard_ids
+
+    def save(self, obj: TypeVar('Base'), fields: Iterable[str] = None):
+        """ Store `obj` and persist it, only its changed `fields` when
+        it is already stored
+        """
+        cls = obj.__class__
+        batch = self._batch_of(cls)
+        with self._file_lock(cls), self._process_lock(cls):
+            self._sync(cls)
+            shard_ids = self._shard_ids_of(cls)
+            with self._lock(cls).write():
+                objs = self._objects(cls)
+                if objs.get(obj.id) is not obj:
+                    if batch is not None:
+                        batch.undo.append((obj.id, objs.get(obj.id)))
+                    self._unindex(cls, obj.id)
+                    objs[obj.id] = obj
+                    self._index(obj)
+                    fields = None
+                    if len(shard_ids) > 1:
+                        shard_ids[_shard(obj.id, len(shard_ids))][
+                            obj.id] = None
+                obj_json = obj.to_json(True)
+                if fields is None:
+                    record = {'op': 'save', 'id': obj.id, 'obj': obj_json}
+                else:
+                    record = {'op': 'update', 'id': obj.id,
+                              'fields': {key: obj_json.get(key)
+                                         for key in fields}}
+            if batch is not None:
+                batch.records.append(record)
+            else:
+                self._persist(cls, [record])
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete `obj` and persist the removal
+        """
+        cls = obj.__class__
+        batch = self._batch_of(cls)
+        with self._file_lock(cls), self._process_lock(cls):
+            self._sync(cls)
+            shard_ids = self._shard_ids_of(cls)
+            with self._lock(cls).write():
+                objs = self._objects(cls)
+                if objs.get(obj.id) is None:
+                    return
+                if batch is not None:
+                    batch.undo.append((obj.id, objs[obj.id]))
+                self._unindex(cls, obj.id)
+                del objs[obj.id]
+                if len(shard_ids) > 1:
+                    shard_ids[_shard(obj.id, len(shard_ids))].pop(obj.id,
+                                                                  None)
+            record = {'op': 'remove', 'id': obj.id}
+            if batch is not None:
+                batch.records.append(record)
+            else:
+                self._persist(cls, [record])
+
+    def remove_all(self, objs: Iterable[TypeVar('Base')]):
+        """ Delete all `objs` in one batch, with one pass over each
+        sorted index of their class
+        """
+        by_class = {}
+        for obj in objs:
+            by_class.setdefault(obj.__class__, []).append(obj)
+        with self.batch():
+            for cls, cls_objs in by_class.items():
+                self._remove_all(cls, cls_objs)
+
+    def _remove_all(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Delete `objs` of `cls` in the batch of the current thread
+        """
+        s_class = cls.__name__
+        batch = self._batch_of(cls)
+        with self._file_lock(cls), self._process_lock(cls):
+            self._sync(cls)
+            shard_ids = self._shard_ids_of(cls)
+            with self._lock(cls).write():
+                stored = self._objects(cls)
+                removed = {}
+                for obj in objs:
+                    if obj.id in stored:
+                        removed[obj.id] = stored[obj.id]
+                if s_class in INDEXES:
+                    for attr in _indexed(cls):
+                        _index_discard_all(
+                            INDEXES[s_class][attr],
+                            [(getattr(obj, attr, None), obj_id)
+                             for obj_id, obj in removed.items()])
+                for obj_id, obj in removed.items():
+                    del stored[obj_id]
+                    if len(shard_ids) > 1:
+                        shard_ids[_shard(obj_id, len(shard_ids))].pop(
+                            obj_id, None)
+                    batch.undo.append((obj_id, obj))
+                    batch.records.append({'op': 'remove', 'id': obj_id})
+
+    @contextmanager
+    def batch(self):
+        """ Persist the mutations of the current thread once per class at
+        the end of the block, or put back the objects it saved and
+        removed on error
+
+        The classes are written one after the other: if writing one
+        fails, the classes already written keep the changes of the
+        block, and the others are reloaded from their files. A nested
+        block is part of the outer one.
+        """
+        if getattr(self._batches, 'classes', None) is not None:
+            yield
+            return
+        classes = self._batches.classes = {}
+        try:
+            with ExitStack() as stack:
+                self._batches.stack = stack
+                try:
+                    yield
+                except BaseException:
+                    for batch in classes.values():
+                        self._rollback(batch)
+                    raise
+                pending = list(classes.values())
+                try:
+                    while len(pending) > 0:
+                        batch = pending[0]
+                        if len(batch.records) > 0 or len(batch.shards) > 0:
+                            self._persist(batch.cls, batch.records,
+                                          batch.shards)
+                        del pending[0]
+                except BaseException:
+                    for batch in pending:
+                        self.load(batch.cls)
+                    raise
+        finally:
+            self._batches.classes = None
+            self._batches.stack = None
+
+    def _batch_of(self, cls: type) -> _Batch:
+        """ _Batch of `cls` in the batch of the current thread, None
+        outside of a batch
+
+        The first call of a batch takes the batch lock, and the first
+        call for `cls` takes its locks, until the end of the batch. The
+        pending write-behind mutations of `cls` are then written in log
+        mode; in snapshot mode, its dirty shards are written with the
+        batch instead, as they already hold the changes of the block.
+        """
+        classes = getattr(self._batches, 'classes', None)
+        if classes is None:
+            return None
+        batch = classes.get(cls.__name__)
+        if batch is None:
+            stack = self._batches.stack
+            if len(classes) == 0:
+                stack.enter_context(self._batch_lock)
+                stack.enter_context(self._flock('batch'))
+            stack.enter_context(self._file_lock(cls))
+            stack.enter_context(self._process_lock(cls))
+            batch = classes[cls.__name__] = _Batch(cls)
+            if _log_mode():
+                self._flush_class(cls)
+            else:
+                with self._dirty_lock:
+                    if self._dirty.pop(cls.__name__, None) is not None:
+                        batch.shards = self._dirty_shards.pop(cls.__name__)
+        return batch
+
+    def _rollback(self, batch: _Batch):
+        """ Put back the objects saved and removed in `batch`, and give
+        the dirty shards it took over back to the write-behind thread,
+        locks held
+        """
+        cls = batch.cls
+        shard_ids = self._shard_ids_of(cls)
+        with self._lock(cls).write():
+            objs = self._objects(cls)
+            for obj_id, obj in reversed(batch.undo):
+                self._unindex(cls, obj_id)
+                if len(shard_ids) > 1:
+                    shard_ids[_shard(obj_id, len(shard_ids))].pop(obj_id,
+                                                                  None)
+                if obj is None:
+                    objs.pop(obj_id, None)
+                    continue
+                objs[obj_id] = obj
+                self._index(obj)
+                if len(shard_ids) > 1:
+                    shard_ids[_shard(obj_id, len(shard_ids))][obj_id] = None
+        if len(batch.shards) > 0:
+            self._persist(cls, [], batch.shards)
+
+    def _flush_class(self, cls: type):
+        """ Write the pending write-behind mutations of `cls`,
+        file lock held
+        """
+        s_class = cls.__name__
+        with self._dirty_lock:
+            if s_class not in self._dirty:
+                return
+            del self._dirty[s_class]
+            shards = self._dirty_shards.pop(s_class)
+            pending = self._pending_log.pop(s_class, None)
+        if pending is not None:
+            _append_log(s_class, pending)
+            self._maybe_compact(cls, shards)
+        else:
+            self.persist_all(cls, shards)
+
+    def _persist(self, cls: type, records: List[dict],
+                 shards: Iterable[int] = ()):
+        """ Write mutations, and the other snapshot `shards`, now or
+        through the write-behind thread
+        """
+        s_class = cls.__name__
+        count = _shard_count()
+        shards = set(shards)
+        shards.update(_shard(record['id'], count) for record in records)
+        if _flush_interval() <= 0 or _coherent():
+            if _log_mode():
+                _append_log(s_class, records)
+                if _coherent():
+                    self._stamps[s_class] = _stamp(s_class)
+                self._maybe_compact(cls, shards)
+            else:
+                self.persist_all(cls, sorted(shards))
+            return
+
+        with self._dirty_lock:
+            self._dirty[s_class] = cls
+            self._dirty_shards.setdefault(s_class, set()).update(shards)
+            if _log_mode():
+                self._pending_log.setdefault(s_class, []).extend(records)
+            self._dirty_count += len(records)
+            full = self._dirty_count >= _flush_max_dirty()
+        self._start_flusher()
+        if full:
+            self._flush_wakeup.set()
+
+    def _start_flusher(self):
+        """ Start the write-behind thread once and flush on clean exit
+        """
+        with self._dirty_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flusher_loop,
+                                             name="models-flusher",
+                                             daemon=True)
+            self._flusher.start()
+        atexit.register(self.flush)
+
+    def _flusher_loop(self):
+        """ Body of the write-behind thread
+        """
+        while True:
+            self._flush_wakeup.wait(_flush_interval() or 1)
+            self._flush_wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """ Write every pending write-behind mutation to disk
+        """
+        with self._flush_lock:
+            with self._dirty_lock:
+                dirty = dict(self._dirty)
+                dirty_shards = dict(self._dirty_shards)
+                pending = dict(self._pending_log)
+                self._dirty.clear()
+                self._dirty_shards.clear()
+                self._pending_log.clear()
+                self._dirty_count = 0
+            for s_class, cls in dirty.items():
+                shards = sorted(dirty_shards[s_class])
+                with self._file_lock(cls):
+                    if s_class in pending:
+                        _append_log(s_class, pending[s_class])
+                        self._maybe_compact(cls, shards)
+                    else:
+                        self.persist_all(cls, shards)
+
+    def compact(self, cls: type, force: bool = False) -> dict:
+        """ Write a new snapshot of the shards of `cls` and empty their
+        log, if `force` or if the log reached the DB_COMPACT_MIN_BYTES
+        and DB_COMPACT_RATIO thresholds
+
+        Writers of `cls` wait, readers only share the read lock taken to
+        collect the objects. Return whether the files were compacted,
+        their size before and after, and the duration.
+        """
+        s_class = cls.__name__
+        count = _shard_count()
+        start = time.monotonic()
+        with self._file_lock(cls), self._process_lock(cls):
+            self._flush_class(cls)
+            before = 0
+            shards = []
+            for shard in range(count):
+                data_size = _file_size(_path(s_class, shard, 'json', count))
+                log_size = _file_size(_path(s_class, shard, 'log', count))
+                before += data_size + log_size
+                if force or (log_size >= _compact_min_bytes() and
+                             log_size >= _compact_ratio() * data_size):
+                    shards.append(shard)
+            if len(shards) > 0:
+                if s_class not in self._stamps:
+                    self.load(cls)
+                self.persist_all(cls, shards)
+            size = sum(_file_size(_path(s_class, shard, ext, count))
+                       for shard in range(count) for ext in ('json', 'log'))
+        return {'compacted': len(shards) > 0,
+                'bytes_before': before,
+                'bytes_after': size,
+                'bytes_reclaimed': before - size,
+                'seconds': time.monotonic() - start}
+
+    def _maybe_compact(self, cls: type, shards: Iterable[int]):
+        """ Compact `cls` if the log of one of `shards` is large enough,
+        file lock held
+        """
+        for shard in shards:
+            if _file_size(_path(cls.__name__, shard, 'log')) >= \
+                    _compact_min_bytes():
+                self.compact(cls)
+                return
+
+    def _index(self, obj: TypeVar('Base')):
+        """ Add `obj` to the indexes of its class, write lock held
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        if s_class not in INDEXES:
+            INDEXES[s_class] = self._build_indexes(cls, self._objects(cls))
+            return
+        for attr in _indexed(cls):
+            _index_add(INDEXES[s_class][attr], getattr(obj, attr, None),
+                       obj.id)
+
+    def _unindex(self, cls: type, obj_id: str):
+        """ Remove the object stored under `obj_id` from the indexes,
+        write lock held
+        """
+        s_class = cls.__name__
+        obj = self._objects(cls).get(obj_id)
+        if obj is None or s_class not in INDEXES:
+            return
+        for attr in _indexed(cls):
+            _index_discard(INDEXES[s_class][attr],
+                           getattr(obj, attr, None), obj_id)
+
+    def reindex(self, obj: TypeVar('Base'), name: str, old, value):
+        """ Move a stored object to the entry of its new `name` value
+        """
+        cls = obj.__class__
+        s_class = cls.__name__
+        obj_id = getattr(obj, 'id', None)
+        if s_class not in INDEXES or \
+                DATA.get(s_class, {}).get(obj_id) is not obj:
+            return
+        with self._lock(cls).write():
+            if DATA.get(s_class, {}).get(obj_id) is not obj:
+                return
+            _index_discard(INDEXES[s_class][name], old, obj_id)
+            _index_add(INDEXES[s_class][name], value, obj_id)
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        self._sync(cls)
+        with self._lock(cls).read():
+            return len(self._objects(cls))
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        self._sync(cls)
+        with self._lock(cls).read():
+            return self._objects(cls).get(id)
+
+    def search(self, cls: type,
+               attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+        """
+        def _search(obj):
+            if len(attributes) == 0:
+                return True
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        self._sync(cls)
+        with self._lock(cls).read():
+            objs = self._objects(cls)
+            candidates = self._index_candidates(cls, attributes)
+            if candidates is None:
+                return list(filter(_search, objs.values()))
+            return list(filter(_search,
+                               (objs[obj_id] for obj_id in candidates)))
+
+    def _index_candidates(self, cls: type,
+                          attributes: dict) -> Iterable[str]:
+        """ Return the IDs matching the indexed part of `attributes`,
+        or None when no indexed attribute can narrow the search
+        """
+        indexes = INDEXES.get(cls.__name__)
+        if indexes is None:
+            return None
+        best = None
+        for k, v in attributes.items():
+            if k not in cls.indexed_attributes or k not in indexes or \
+                    _index_key(v) is None:
+                continue
+            bucket = indexes[k].get(v, {})
+            if best is None or len(bucket) < len(best):
+                best = bucket
+        if best is None:
+            return None
+        return list(best)
+
+    def iter_search(self, cls: type, attributes: dict,
+                    after: Tuple = None) -> Iterator[TypeVar('Base')]:
+        """ Yield the matching objects in (created_at, id) order,
+        starting after the (timestamp, ID) key `after`
+
+        Objects are fetched in chunks, the read lock being released
+        between two chunks.
+        """
+        def _match(obj):
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        self._sync(cls)
+        with self._lock(cls).read():
+            candidates = self._index_candidates(cls, attributes)
+            if candidates is not None:
+                objs = self._objects(cls)
+                keys = sorted((objs[obj_id]._created_ts, obj_id)
+                              for obj_id in candidates)
+                order = SortedIndex(keys)
+            else:
+                order = INDEXES.get(cls.__name__, {}).get('_created_ts')
+            if order is None:
+                return
+        while True:
+            with self._lock(cls).read():
+                keys = order.after(after, ITER_CHUNK_SIZE)
+                objs = self._objects(cls)
+                chunk = [objs.get(obj_id) for _, obj_id in keys]
+            for obj in chunk:
+                if obj is not None and _match(obj):
+                    yield obj
+            if len(keys) < ITER_CHUNK_SIZE:
+                return
+            after = keys[-1]
+
+    def range_search(self, cls: type, name: str, low: float = None,
+                     high: float = None,
+                     limit: int = None) -> List[TypeVar('Base')]:
+        """ Objects of `cls` with low <= `name` < high, ordered by `name`,
+        at most `limit` of them, in O(log N + k) with the sorted index
+        of `name`
+        """
+        self._sync(cls)
+        with self._lock(cls).read():
+            order = INDEXES.get(cls.__name__, {}).get(name)
+            if order is None:
+                return []
+            objs = self._objects(cls)
+            return [objs[obj_id]
+                    for obj_id in order.between(low, high, limit)]
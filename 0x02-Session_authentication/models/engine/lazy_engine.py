@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+""" Storage engine materializing the objects on demand
+
+Loading a class only reads the position of each object in
+.db_<Class>.json: the file is memory-mapped and an object is decoded
+when it is first needed, then kept in a bounded LRU cache of
+DB_CACHE_SIZE objects per class. The equality index of an attribute is
+built on the first search by this attribute.
+
+Mutations are appended to .db_<Class>.log with the records of the file
+engine, and the changed objects stay in memory until the log is
+compacted into a new data file, so both engines share the same files.
+Writes are synchronous, the files must not be shared with other
+processes, DB_SHARDS must be 1 and DB_COMPRESSION none: a compressed
+data file is rewritten in plain text when it is loaded. `iter_search`
+and the time-window queries decode every object of the class.
+"""
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Iterable, Iterator, List, Tuple, TypeVar
+from os import getenv, path
+from models.engine.file_engine import (_append_log, _compact_min_bytes,
+                                       _compact_ratio, _compression,
+                                       _file_size, _index_add,
+                                       _index_discard, _index_key,
+                                       _open_data, _read_log,
+                                       _shard_count, _write_atomic)
+from models.engine.storage_engine import StorageEngine
+from models.json_stream import dump_json_object, iter_json_object
+import itertools
+import json
+import mmap
+import os
+import threading
+import time
+
+
+_decoder = json.JSONDecoder()
+
+
+def _cache_size() -> int:
+    """ Number of decoded objects kept per class (DB_CACHE_SIZE)
+    """
+    try:
+        return int(getenv('DB_CACHE_SIZE', '10000'))
+    except ValueError:
+        return 10000
+
+
+class _Table():
+    """ State of one class: the mapped data file, the offsets of its
+    objects, the objects changed since it was written, the cache and
+    the indexes built so far
+    """
+
+    def __init__(self):
+        """ Initialize an empty table
+        """
+        self.lock = threading.RLock()
+        self.file = None
+        self.data = b""
+        # ID -> offset of the line of the object in the data file
+        self.offsets = {}
+        # objects saved, and IDs of the data file removed, since
+        self.changed = {}
+        self.removed = set()
+        self.cache = OrderedDict()
+        # attribute -> {value: {ID: None}}, and {ID: value}
+        self.indexes = {}
+        self.values = {}
+
+    def map(self, file_path: str) -> bool:
+        """ Map the data file and read the offsets of its objects,
+        return False if it does not have one object per line
+        """
+        f = open(file_path, 'rb')
+        offsets = {}
+        offset = 0
+        for line in f:
+            start = offset
+            offset += len(line)
+            if line.rstrip(b"\r\n") in (b"{", b"}", b"{}", b""):
+                continue
+            end = line.find(b'"', 1)
+            if line[:1] != b'"' or end < 0 or \
+                    line.rstrip(b",\r\n")[-1:] != b"}":
+                f.close()
+                return False
+            if line.find(b"\\", 1, end) < 0:
+                obj_id = line[1:end].decode()
+            else:
+                obj_id = _decoder.raw_decode(line.decode())[0]
+            offsets[obj_id] = start
+        self.file = f
+        self.data = b""
+        if offset > 0:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = offsets
+        return True
+
+    def line(self, obj_id: str) -> bytes:
+        """ Encoded member of `obj_id` in the data file
+        """
+        offset = self.offsets[obj_id]
+        end = self.data.find(b"\n", offset)
+        if end < 0:
+            end = len(self.data)
+        return self.data[offset:end].rstrip(b",\r")
+
+    def record(self, obj_id: str) -> dict:
+        """ Decode the record of `obj_id` from the data file
+        """
+        line = self.line(obj_id).decode()
+        _, pos = _decoder.raw_decode(line)
+        return json.loads(line[pos + 1:])
+
+    def scan(self, attr: str) -> Iterator[Tuple[str, object]]:
+        """ Yield the (ID, value of `attr`) pairs of the objects only
+        stored in the data file, decoding nothing else
+
+        Inside a JSON string, a quote is always escaped: the key of
+        `attr` preceded by "{" or ", " cannot be part of a value.
+        """
+        key = json.dumps(attr).encode() + b": "
+        inner = b", " + key
+        first = b"{" + key
+        data = self.data
+        size = len(data)
+        for obj_id, offset in self.offsets.items():
+            if obj_id in self.removed or obj_id in self.changed or \
+                    obj_id in self.cache:
+                continue
+            end = data.find(b"\n", offset)
+            if end < 0:
+                end = size
+            pos = data.find(inner, offset, end)
+            if pos >= 0:
+                pos += len(inner)
+            else:
+                pos = data.find(first, offset, end)
+                if pos < 0:
+                    yield obj_id, None
+                    continue
+                pos += len(first)
+            yield obj_id, _decoder.raw_decode(data[pos:end].decode())[0]
+
+    def ids(self) -> Iterable[str]:
+        """ IDs of the stored objects
+        """
+        for obj_id in self.offsets:
+            if obj_id not in self.removed:
+                yield obj_id
+        for obj_id in self.changed:
+            if obj_id not in self.offsets:
+                yield obj_id
+
+    def contains(self, obj_id: str) -> bool:
+        """ True if `obj_id` is stored
+        """
+        return obj_id in self.changed or \
+            (obj_id in self.offsets and obj_id not in self.removed)
+
+    def current(self, obj_id: str) -> TypeVar('Base'):
+        """ Decoded instance of `obj_id`, None if it is not decoded
+        """
+        obj = self.changed.get(obj_id)
+        if obj is None:
+            obj = self.cache.get(obj_id)
+        return obj
+
+
+class LazyFileEngine(StorageEngine):
+    """ Storage engine decoding the objects of the data files on demand
+    """
+
+    def __init__(self):
+        """ Initialize the engine
+        """
+        self._tables = {}
+        self._tables_lock = threading.Lock()
+        # batch of the current thread: locks and records per class, and
+        # lock taken by a batch before any table lock
+        self._batches = threading.local()
+        self._batch_lock = threading.Lock()
+
+    def _table(self, cls: type) -> _Table:
+        """ Table of `cls`, loaded on first use
+        """
+        table = self._tables.get(cls.__name__)
+        if table is None:
+            self.load(cls)
+            table = self._tables[cls.__name__]
+        return table
+
+    def load(self, cls: type, progress: Callable[[int], None] = None,
+             progress_every: int = 10000) -> dict:
+        """ Map the data file and read the offsets of its objects, then
+        replay the mutation log
+
+        A data file without one object per line, or compressed, is
+        rewritten first.
+        """
+        s_class = cls.__name__
+        if _shard_count() > 1:
+            raise ValueError("The lazy engine does not support DB_SHARDS")
+        if _compression()[0] != 'none':
+            raise ValueError("The lazy engine does not support "
+                             "DB_COMPRESSION")
+        start = time.monotonic()
+        file_path = ".db_{}.json".format(s_class)
+        table = _Table()
+        if path.exists(file_path) and not table.map(file_path):
+            with _open_data(file_path) as f:
+                records = list(iter_json_object(f))
+            _write_atomic(file_path,
+                          lambda f: dump_json_object(records, f))
+            del records
+            table.map(file_path)
+        self._replay_log(cls, table)
+        with self._tables_lock:
+            self._tables[s_class] = table
+        count = self.count(cls)
+        if progress is not None:
+            progress(count)
+        return {'objects': count,
+                'seconds': time.monotonic() - start,
+                'peak_rss_kb': None}
+
+    def _replay_log(self, cls: type, table: _Table):
+        """ Apply the records of the class log file on top of `table`
+        """
+        log_path = ".db_{}.log".format(cls.__name__)
+        if not path.exists(log_path):
+            return
+
+        for record in _read_log(log_path):
+            obj_id = record['id']
+            if record['op'] == 'save':
+                table.changed[obj_id] = next(cls.from_records(
+                    [record['obj']]))
+                table.removed.discard(obj_id)
+            elif record['op'] == 'update':
+                obj = table.changed.get(obj_id)
+                if obj is None:
+                    if not table.contains(obj_id):
+                        continue
+                    obj = next(cls.from_records(
+                        [table.record(obj_id)]))
+                for key, value in record['fields'].items():
+                    setattr(obj, key, value)
+                obj._changed = None
+                table.changed[obj_id] = obj
+            elif record['op'] == 'remove':
+                table.changed.pop(obj_id, None)
+                if obj_id in table.offsets:
+                    table.removed.add(obj_id)
+
+    def _decode(self, cls: type, table: _Table,
+                obj_id: str) -> TypeVar('Base'):
+        """ Object `obj_id` from the changes, the cache or the data file,
+        table lock held
+        """
+        obj = table.changed.get(obj_id)
+        if obj is not None:
+            return obj
+        obj = table.cache.get(obj_id)
+        if obj is not None:
+            table.cache.move_to_end(obj_id)
+            return obj
+        if obj_id not in table.offsets or obj_id in table.removed:
+            return None
+        obj = next(cls.from_records([table.record(obj_id)]))
+        table.cache[obj_id] = obj
+        self._evict(cls, table)
+        return obj
+
+    def _evict(self, cls: type, table: _Table):
+        """ Drop the least recently used objects beyond DB_CACHE_SIZE,
+        table lock held
+
+        An object with unsaved changes gets back the index entries of its
+        stored values, which it has when it is decoded again.
+        """
+        while len(table.cache) > _cache_size():
+            obj_id, obj = table.cache.popitem(last=False)
+            if len(table.indexes) > 0 and getattr(obj, '_changed', None):
+                self._reindex(table, next(cls.from_records(
+                    [table.record(obj_id)])))
+
+    def _index(self, cls: type, table: _Table, attr: str) -> dict:
+        """ Equality index of `attr`, built on first use, table lock held
+        """
+        index = table.indexes.get(attr)
+        if index is not None:
+            return index
+        index = {}
+        values = {}
+        decoded = ((obj_id, getattr(obj, attr, None)) for obj_id, obj
+                   in itertools.chain(table.cache.items(),
+                                      table.changed.items()))
+        for obj_id, value in itertools.chain(table.scan(attr), decoded):
+            if _index_key(value) is not None:
+                _index_add(index, value, obj_id)
+                values[obj_id] = value
+        table.indexes[attr] = index
+        table.values[attr] = values
+        return index
+
+    def _reindex(self, table: _Table, obj: TypeVar('Base')):
+        """ Update the built indexes for `obj`, table lock held
+        """
+        for attr, index in table.indexes.items():
+            values = table.values[attr]
+            old = values.get(obj.id)
+            value = getattr(obj, attr, None)
+            if old is not None and old == value:
+                continue
+            if old is not None:
+                _index_discard(index, old, obj.id)
+                del values[obj.id]
+            if _index_key(value) is not None:
+                _index_add(index, value, obj.id)
+                values[obj.id] = value
+
+    def _unindex(self, table: _Table, obj_id: str):
+        """ Remove `obj_id` from the built indexes, table lock held
+        """
+        for attr, index in table.indexes.items():
+            old = table.values[attr].pop(obj_id, None)
+            if old is not None:
+                _index_discard(index, old, obj_id)
+
+    def reindex(self, obj: TypeVar('Base'), name: str, old, value):
+        """ Update the index of `name` if it is built and `obj` is the
+        decoded instance of its ID
+        """
+        table = self._tables.get(obj.__class__.__name__)
+        if table is None or name not in table.indexes:
+            return
+        with table.lock:
+            if table.current(getattr(obj, 'id', None)) is obj:
+                self._reindex(table, obj)
+
+    def persist_all(self, cls: type):
+        """ Write every object of `cls` to a new data file
+        """
+        table = self._table(cls)
+        with table.lock:
+            self._rewrite(cls, table)
+
+    def _rewrite(self, cls: type, table: _Table):
+        """ Write the data file of `cls` from the unchanged lines of the
+        current one and the changed objects, then empty the log and map
+        the new file, table lock held
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        offsets = {}
+
+        def write(f):
+            pos = 0
+            sep = b"{\n"
+            members = [(obj_id, table.line(obj_id))
+                       for obj_id in table.offsets
+                       if obj_id not in table.removed and
+                       obj_id not in table.changed]
+            members.extend(
+                (obj_id, "{}: {}".format(
+                    json.dumps(obj_id),
+                    json.dumps(obj.to_json(True))).encode())
+                for obj_id, obj in table.changed.items())
+            for obj_id, member in members:
+                f.write(sep)
+                pos += len(sep)
+                offsets[obj_id] = pos
+                f.write(member)
+                pos += len(member)
+                sep = b",\n"
+            f.write(b"{}\n" if sep == b"{\n" else b"\n}\n")
+
+        _write_atomic(file_path, write, 'wb')
+        log_path = ".db_{}.log".format(s_class)
+        if path.exists(log_path):
+            open(log_path, 'w').close()
+        table.file = open(file_path, 'rb')
+        table.data = mmap.mmap(table.file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        table.offsets = offsets
+        table.cache.update(table.changed)
+        table.changed = {}
+        self._evict(cls, table)
+        table.removed = set()
+
+    def compact(self, cls: type, force: bool = False) -> dict:
+        """ Write a new data file and empty the log, if `force` or if the
+        log reached the DB_COMPACT_MIN_BYTES and DB_COMPACT_RATIO
+        thresholds
+        """
+        s_class = cls.__name__
+        data_path = ".db_{}.json".format(s_class)
+        log_path = ".db_{}.log".format(s_class)
+        start = time.monotonic()
+        table = self._table(cls)
+        with table.lock:
+            data_size = _file_size(data_path)
+            log_size = _file_size(log_path)
+            compacted = force or (log_size >= _compact_min_bytes() and
+                                  log_size >= _compact_ratio() * data_size)
+            if compacted:
+                self._rewrite(cls, table)
+            size = _file_size(data_path) + _file_size(log_path)
+        return {'compacted': compacted,
+                'bytes_before': data_size + log_size,
+                'bytes_after': size,
+                'bytes_reclaimed': data_size + log_size - size,
+                'seconds': time.monotonic() - start}
+
+    def _persist(self, cls: type, records: List[dict]):
+        """ Append mutations to the log of `cls`, compacting it when it
+        is large enough, table lock held
+        """
+        _append_log(cls.__name__, records)
+        if _file_size(".db_{}.log".format(cls.__name__)) >= \
+                _compact_min_bytes():
+            self.compact(cls)
+
+    def save(self, obj: TypeVar('Base'), fields: Iterable[str] = None):
+        """ Store `obj` and log it, only its changed `fields` when it is
+        the stored instance
+        """
+        cls = obj.__class__
+        table = self._table(cls)
+        batch = self._batch_records(cls, table)
+        with table.lock:
+            if table.current(obj.id) is not obj or \
+                    not table.contains(obj.id):
+                fields = None
+            table.cache.pop(obj.id, None)
+            table.changed[obj.id] = obj
+            table.removed.discard(obj.id)
+            self._reindex(table, obj)
+            obj_json = obj.to_json(True)
+            if fields is None:
+                record = {'op': 'save', 'id': obj.id, 'obj': obj_json}
+            else:
+                record = {'op': 'update', 'id': obj.id,
+                          'fields': {key: obj_json.get(key)
+                                     for key in fields}}
+            if batch is not None:
+                batch.append(record)
+            else:
+                self._persist(cls, [record])
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete `obj` and log the removal
+        """
+        cls = obj.__class__
+        table = self._table(cls)
+        batch = self._batch_records(cls, table)
+        with table.lock:
+            if not table.contains(obj.id):
+                return
+            table.changed.pop(obj.id, None)
+            table.cache.pop(obj.id, None)
+            if obj.id in table.offsets:
+                table.removed.add(obj.id)
+            self._unindex(table, obj.id)
+            record = {'op': 'remove', 'id': obj.id}
+            if batch is not None:
+                batch.append(record)
+            else:
+                self._persist(cls, [record])
+
+    @contextmanager
+    def batch(self):
+        """ Log the mutations of the current thread once per class at the
+        end of the block, or reload the changed classes on error
+
+        A nested block is part of the outer one.
+        """
+        if getattr(self._batches, 'classes', None) is not None:
+            yield
+            return
+        classes = self._batches.classes = {}
+        try:
+            with ExitStack() as stack:
+                self._batches.stack = stack
+                try:
+                    yield
+                    for cls, records in classes.values():
+                        if len(records) > 0:
+                            self._persist(cls, records)
+                except BaseException:
+                    for cls, _ in classes.values():
+                        self.load(cls)
+                    raise
+        finally:
+            self._batches.classes = None
+            self._batches.stack = None
+
+    def _batch_records(self, cls: type, table: _Table) -> List[dict]:
+        """ Pending records of `cls` in the batch of the current thread,
+        None outside of a batch; the batch lock, then the table lock,
+        are held until the end of the batch, so that batches changing
+        several classes do not wait for each other's table locks
+        """
+        classes = getattr(self._batches, 'classes', None)
+        if classes is None:
+            return None
+        entry = classes.get(cls.__name__)
+        if entry is None:
+            if len(classes) == 0:
+                self._batches.stack.enter_context(self._batch_lock)
+            self._batches.stack.enter_context(table.lock)
+            entry = classes[cls.__name__] = (cls, [])
+        return entry[1]
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        table = self._table(cls)
+        with table.lock:
+            return len(table.offsets) - len(table.removed) + \
+                sum(1 for obj_id in table.changed
+                    if obj_id not in table.offsets)
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        table = self._table(cls)
+        with table.lock:
+            return self._decode(cls, table, id)
+
+    def search(self, cls: type,
+               attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes, decoding only
+        the candidates of the indexed attributes
+        """
+        table = self._table(cls)
+        with table.lock:
+            best = None
+            for k, v in attributes.items():
+                if k not in cls.indexed_attributes or \
+                        _index_key(v) is None:
+                    continue
+                bucket = self._index(cls, table, k).get(v, {})
+                if best is None or len(bucket) < len(best):
+                    best = bucket
+            candidates = list(table.ids() if best is None else best)
+            objs = []
+            for obj_id in candidates:
+                obj = self._decode(cls, table, obj_id)
+                if obj is not None and \
+                        all(getattr(obj, k) == v
+                            for k, v in attributes.items()):
+                    objs.append(obj)
+            return objs
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+""" Locks shared by the storage engines
+"""
+from contextlib import contextmanager
+import threading
+
+
+class RWLock():
+    """ Readers-writer lock: many concurrent readers or one writer
+
+    Waiting writers block new readers, so a steady flow of reads cannot
+    starve a write. The lock is not reentrant.
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        """ Wait until no writer holds or waits for the lock
+        """
+        with self._cond:
+            while self._writer or self._writers_waiting > 0:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        """ Release a read acquisition
+        """
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        """ Wait until no reader or writer holds the lock
+        """
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers > 0:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        """ Release the write acquisition
+        """
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock for reading in a `with` block
+        """
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock for writing in a `with` block
+        """
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
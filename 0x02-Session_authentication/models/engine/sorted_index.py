@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+""" Ordered index of object IDs
+"""
+from bisect import bisect_left, bisect_right
+from typing import List, Tuple
+
+
+# above this many entries, discard_all rebuilds the lists in one pass
+DISCARD_ONE_BY_ONE = 1024
+
+
+class SortedIndex():
+    """ (value, ID) pairs kept sorted with bisect
+
+    Values and IDs are stored in two parallel lists, so an entry costs
+    two references: the value and the ID are shared with the object.
+    """
+
+    def __init__(self, pairs: List[Tuple] = ()):
+        """ Initialize the index with (value, ID) pairs
+        """
+        pairs = sorted(pairs)
+        self._values = [value for value, _ in pairs]
+        self._ids = [obj_id for _, obj_id in pairs]
+
+    def __len__(self) -> int:
+        """ Number of entries
+        """
+        return len(self._ids)
+
+    def _position(self, value, obj_id: str) -> int:
+        """ Position of the first entry after or equal to (value, ID)
+        """
+        lo = bisect_left(self._values, value)
+        hi = bisect_right(self._values, value, lo)
+        return bisect_left(self._ids, obj_id, lo, hi)
+
+    def add(self, value, obj_id: str):
+        """ Insert the entry (value, ID)
+        """
+        if value is None:
+            return
+        pos = self._position(value, obj_id)
+        self._values.insert(pos, value)
+        self._ids.insert(pos, obj_id)
+
+    def discard(self, value, obj_id: str):
+        """ Remove the entry (value, ID) if present
+        """
+        if value is None:
+            return
+        pos = self._position(value, obj_id)
+        if pos < len(self._ids) and self._ids[pos] == obj_id and \
+                self._values[pos] == value:
+            del self._values[pos]
+            del self._ids[pos]
+
+    def discard_all(self, pairs: List[Tuple]):
+        """ Remove the entries (value, ID) of `pairs` that are present
+
+        Many entries are removed in one pass over the index instead of
+        one list deletion each.
+        """
+        pairs = {(value, obj_id) for value, obj_id in pairs
+                 if value is not None}
+        if len(pairs) <= DISCARD_ONE_BY_ONE:
+            for value, obj_id in pairs:
+                self.discard(value, obj_id)
+            return
+        kept = [entry for entry in zip(self._values, self._ids)
+                if entry not in pairs]
+        self._values = [value for value, _ in kept]
+        self._ids = [obj_id for _, obj_id in kept]
+
+    def after(self, key: Tuple = None, count: int = 100) -> List[Tuple]:
+        """ Up to `count` entries strictly after the (value, ID) `key`,
+        from the first entry when `key` is None
+        """
+        pos = 0
+        if key is not None:
+            value, obj_id = key
+            lo = bisect_left(self._values, value)
+            hi = bisect_right(self._values, value, lo)
+            pos = bisect_right(self._ids, obj_id, lo, hi)
+        end = pos + count
+        return list(zip(self._values[pos:end], self._ids[pos:end]))
+
+    def between(self, low=None, high=None, limit: int = None) -> List[str]:
+        """ IDs of the first `limit` entries with low <= value < high,
+        in order, a None bound or limit being unbounded
+        """
+        lo = 0 if low is None else bisect_left(self._values, low)
+        hi = len(self._values) if high is None \
+            else bisect_left(self._values, high)
+        if limit is not None:
+            hi = min(hi, lo + max(0, limit))
+        return self._ids[lo:hi]
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+""" SQLite storage engine
+
+Each class is stored in its own table, with one column per attribute
+returned by `to_json(True)` and an index on each `indexed_attributes`.
+Objects are read from the database on every call: `get` and `search`
+return new instances. A `batch()` block is one transaction.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import math
+from typing import Callable, Iterable, Iterator, List, Tuple, TypeVar
+from models.base import TIMESTAMP_FORMAT, _EPOCH
+from models.engine.file_engine import _file_size
+from models.engine.storage_engine import StorageEngine
+import sqlite3
+import threading
+import time
+
+
+ITER_CHUNK_SIZE = 256
+
+
+def _column_time(ts: float) -> str:
+    """ Column value of the timestamp `ts`
+    """
+    return (_EPOCH + timedelta(seconds=ts)).strftime(TIMESTAMP_FORMAT)
+
+
+def _quote(name: str) -> str:
+    """ Quote an SQL identifier
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class SQLiteEngine(StorageEngine):
+    """ Storage engine backed by an SQLite database file
+    """
+
+    def __init__(self, db_path: str):
+        """ Initialize the engine on the database file `db_path`
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._tables = {}
+        self._tables_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        """ Connection of the current thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """ Connection of the current thread, committed at the end of the
+        block unless a batch is running
+        """
+        conn = self._conn()
+        if getattr(self._local, 'batch', False):
+            yield conn
+            return
+        with conn:
+            yield conn
+
+    @contextmanager
+    def batch(self):
+        """ Run the saves and removals of the block in one transaction,
+        rolled back on error
+        """
+        if getattr(self._local, 'batch', False):
+            yield
+            return
+        conn = self._conn()
+        self._local.batch = True
+        try:
+            with conn:
+                conn.execute("BEGIN")
+                yield
+        except BaseException:
+            # tables created in the transaction are gone
+            self._tables.clear()
+            raise
+        finally:
+            self._local.batch = False
+
+    def _columns(self, cls: type) -> tuple:
+        """ Columns of the table of `cls`, creating it if needed
+        """
+        s_class = cls.__name__
+        columns = self._tables.get(s_class)
+        if columns is not None:
+            return columns
+        with self._tables_lock:
+            columns = cls._json_fields()
+            table = _quote(s_class)
+            defs = ", ".join(
+                "{} TEXT PRIMARY KEY".format(_quote(c)) if c == 'id'
+                else _quote(c) for c in columns)
+            with self._transaction() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS {} ({})"
+                             .format(table, defs))
+                for attr in cls.indexed_attributes:
+                    conn.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})"
+                                 .format(_quote(s_class + "_" + attr),
+                                         table, _quote(attr)))
+                conn.execute("CREATE INDEX IF NOT EXISTS {} ON {} "
+                             "(created_at, id)"
+                             .format(_quote(s_class + "__created_at"),
+                                     table))
+                conn.execute("CREATE INDEX IF NOT EXISTS {} ON {} "
+                             "(updated_at)"
+                             .format(_quote(s_class + "__updated_at"),
+                                     table))
+            self._tables[s_class] = columns
+        return columns
+
+    def _hydrate(self, cls: type, columns: tuple, rows) -> List:
+        """ Build objects of `cls` from rows of its table
+        """
+        return list(cls.from_records(dict(zip(columns, row)) for row in rows))
+
+    def _select(self, cls: type, where: str = "", params: tuple = (),
+                order: str = "rowid",
+                limit: int = None) -> List[TypeVar('Base')]:
+        """ Objects of `cls` matching the WHERE clause `where`, at most
+        `limit` of them
+        """
+        columns = self._columns(cls)
+        sql = "SELECT {} FROM {}{} ORDER BY {}".format(
+            ", ".join(_quote(c) for c in columns), _quote(cls.__name__),
+            where, order)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = tuple(params) + (max(0, limit),)
+        rows = self._conn().execute(sql, params).fetchall()
+        return self._hydrate(cls, columns, rows)
+
+    def _where(self, cls: type, attributes: dict) -> Tuple:
+        """ SQL conditions and parameters for the `attributes` having a
+        column, and the remaining attributes to compare in Python
+        """
+        columns = self._columns(cls)
+        clauses = []
+        params = []
+        remaining = {}
+        for k, v in attributes.items():
+            if k not in columns:
+                remaining[k] = v
+                continue
+            if isinstance(v, datetime):
+                v = v.strftime(TIMESTAMP_FORMAT)
+            if v is None:
+                clauses.append("{} IS NULL".format(_quote(k)))
+            else:
+                clauses.append("{} = ?".format(_quote(k)))
+                params.append(v)
+        return clauses, params, remaining
+
+    def load(self, cls: type, progress: Callable[[int], None] = None,
+             progress_every: int = 10000) -> dict:
+        """ Create the table of `cls` if needed
+        """
+        start = time.monotonic()
+        count = self.count(cls)
+        if progress is not None:
+            progress(count)
+        return {'objects': count,
+                'seconds': time.monotonic() - start,
+                'peak_rss_kb': None}
+
+    def persist_all(self, cls: type):
+        """ Rows are written by each save: nothing is pending
+        """
+        self._columns(cls)
+
+    def save(self, obj: TypeVar('Base'), fields: Iterable[str] = None):
+        """ Insert or update the row of `obj`, only the columns of the
+        changed `fields` when the row exists
+        """
+        columns = self._columns(obj.__class__)
+        values = obj.to_json(True)
+        if fields is not None:
+            fields = [c for c in columns if c in fields and c != 'id']
+        if fields:
+            sql = "UPDATE {} SET {} WHERE id = ?".format(
+                _quote(obj.__class__.__name__),
+                ", ".join("{} = ?".format(_quote(c)) for c in fields))
+            with self._transaction() as conn:
+                cursor = conn.execute(sql, tuple(values.get(c)
+                                                 for c in fields) + (obj.id,))
+            if cursor.rowcount > 0:
+                return
+        sql = "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT(id) DO UPDATE " \
+              "SET {}".format(
+                  _quote(obj.__class__.__name__),
+                  ", ".join(_quote(c) for c in columns),
+                  ", ".join("?" for _ in columns),
+                  ", ".join("{0} = excluded.{0}".format(_quote(c))
+                            for c in columns if c != 'id'))
+        with self._transaction() as conn:
+            conn.execute(sql, tuple(values.get(c) for c in columns))
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete the row of `obj`
+        """
+        self._columns(obj.__class__)
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM {} WHERE id = ?"
+                         .format(_quote(obj.__class__.__name__)), (obj.id,))
+
+    def compact(self, cls: type, force: bool = False) -> dict:
+        """ Copy the write-ahead log into the database file and truncate
+        it; the log is shared by every class
+        """
+        wal_path = self.db_path + "-wal"
+        start = time.monotonic()
+        before = _file_size(self.db_path) + _file_size(wal_path)
+        self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        after = _file_size(self.db_path) + _file_size(wal_path)
+        return {'compacted': True, 'bytes_before': before,
+                'bytes_after': after, 'bytes_reclaimed': before - after,
+                'seconds': time.monotonic() - start}
+
+    def count(self, cls: type) -> int:
+        """ Count the rows of `cls`
+        """
+        self._columns(cls)
+        row = self._conn().execute("SELECT COUNT(*) FROM {}"
+                                   .format(_quote(cls.__name__))).fetchone()
+        return row[0]
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        objs = self._select(cls, " WHERE id = ?", (id,))
+        return objs[0] if len(objs) > 0 else None
+
+    def search(self, cls: type,
+               attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+
+        Attributes without a column are compared in Python.
+        """
+        clauses, params, remaining = self._where(cls, attributes)
+        where = ""
+        if len(clauses) > 0:
+            where = " WHERE " + " AND ".join(clauses)
+        objs = self._select(cls, where, tuple(params))
+        if len(remaining) == 0:
+            return objs
+        return [obj for obj in objs
+                if all(getattr(obj, k) == v for k, v in remaining.items())]
+
+    def iter_search(self, cls: type, attributes: dict,
+                    after: Tuple = None) -> Iterator[TypeVar('Base')]:
+        """ Yield the matching objects in (created_at, id) order,
+        starting after the (timestamp, ID) key `after`, one chunk of
+        rows per query
+        """
+        clauses, params, remaining = self._where(cls, attributes)
+        while True:
+            chunk_clauses = list(clauses)
+            chunk_params = list(params)
+            if after is not None:
+                ts = (_EPOCH + timedelta(seconds=after[0])) \
+                    .strftime(TIMESTAMP_FORMAT)
+                chunk_clauses.append(
+                    "(created_at > ? OR (created_at = ? AND id > ?))")
+                chunk_params.extend([ts, ts, after[1]])
+            where = ""
+            if len(chunk_clauses) > 0:
+                where = " WHERE " + " AND ".join(chunk_clauses)
+            objs = self._select(cls, where, tuple(chunk_params),
+                                "created_at, id LIMIT {:d}"
+                                .format(ITER_CHUNK_SIZE))
+            for obj in objs:
+                if all(getattr(obj, k) == v for k, v in remaining.items()):
+                    yield obj
+            if len(objs) < ITER_CHUNK_SIZE:
+                return
+            after = (objs[-1]._created_ts, objs[-1].id)
+
+    def range_search(self, cls: type, name: str, low: float = None,
+                     high: float = None,
+                     limit: int = None) -> List[TypeVar('Base')]:
+        """ Objects of `cls` with low <= `name` < high, ordered by `name`,
+        at most `limit` of them
+
+        The stored timestamps have no fraction of second, so the window
+        is widened to whole seconds.
+        """
+        column = _quote(name.strip('_').replace('_ts', '_at'))
+        clauses = []
+        params = []
+        if low is not None:
+            clauses.append("{} >= ?".format(column))
+            params.append(_column_time(math.floor(low)))
+        if high is not None:
+            clauses.append("{} < ?".format(column))
+            params.append(_column_time(math.ceil(high)))
+        where = ""
+        if len(clauses) > 0:
+            where = " WHERE " + " AND ".join(clauses)
+        return self._select(cls, where, tuple(params), column + ", id",
+                            limit)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+""" Storage engine interface
+"""
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Tuple, TypeVar
+
+
+class StorageEngine():
+    """ Persistence of the Base subclasses
+
+    Every method receives the model class (or an instance of it), so a
+    single engine serves all the classes.
+    """
+
+    def load(self, cls: type, progress: Callable[[int], None] = None,
+             progress_every: int = 10000) -> dict:
+        """ Prepare the storage of `cls`, return load statistics
+        """
+        raise NotImplementedError()
+
+    def persist_all(self, cls: type):
+        """ Write every object of `cls` to the storage
+        """
+        raise NotImplementedError()
+
+    def flush(self):
+        """ Write every pending mutation
+        """
+        pass
+
+    def save(self, obj: TypeVar('Base'), fields: Iterable[str] = None):
+        """ Store `obj`
+
+        `fields` lists the keys of `to_json(True)` changed since `obj`
+        was loaded or saved, None when it must be stored whole.
+        """
+        raise NotImplementedError()
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete `obj` from the storage
+        """
+        raise NotImplementedError()
+
+    def remove_all(self, objs: Iterable[TypeVar('Base')]):
+        """ Delete all `objs` in one batch
+        """
+        with self.batch():
+            for obj in objs:
+                self.remove(obj)
+
+    @contextmanager
+    def batch(self):
+        """ Group the saves and removals of the current thread made in the
+        block: all of them are persisted at the end, or none on error
+        """
+        yield
+
+    def compact(self, cls: type, force: bool = False) -> dict:
+        """ Reclaim the space of the obsolete data of `cls`, return
+        whether anything was done, the sizes before and after and the
+        duration
+        """
+        return {'compacted': False, 'bytes_before': 0, 'bytes_after': 0,
+                'bytes_reclaimed': 0, 'seconds': 0.0}
+
+    def reindex(self, obj: TypeVar('Base'), name: str, old, value):
+        """ Called after the indexed attribute `name` of `obj` changed
+        from `old` to `value`
+        """
+        pass
+
+    def count(self, cls: type) -> int:
+        """ Number of stored objects of `cls`
+        """
+        raise NotImplementedError()
+
+    def all(self, cls: type) -> Iterable[TypeVar('Base')]:
+        """ Every stored object of `cls`
+        """
+        return self.search(cls, {})
+
+    def get(self, cls: type, id: str) -> TypeVar('Base'):
+        """ Stored object of `cls` with this ID, or None
+        """
+        raise NotImplementedError()
+
+    def search(self, cls: type,
+               attributes: dict) -> List[TypeVar('Base')]:
+        """ Stored objects of `cls` matching every attribute value
+        """
+        raise NotImplementedError()
+
+    def iter_search(self, cls: type, attributes: dict,
+                    after: Tuple = None) -> Iterator[TypeVar('Base')]:
+        """ Yield the matching objects in (created_at, id) order,
+        starting after the (timestamp, ID) key `after`
+        """
+        objs = sorted(self.search(cls, attributes),
+                      key=lambda obj: (obj._created_ts, obj.id))
+        for obj in objs:
+            if after is None or (obj._created_ts, obj.id) > after:
+                yield obj
+
+    def range_search(self, cls: type, name: str, low: float = None,
+                     high: float = None,
+                     limit: int = None) -> List[TypeVar('Base')]:
+        """ Objects of `cls` with low <= `name` < high, ordered by `name`,
+        at most `limit` of them, `name` being one of the
+        `ordered_attributes` timestamps
+        """
+        objs = [obj for obj in self.search(cls, {})
+                if (low is None or getattr(obj, name) >= low) and
+                (high is None or getattr(obj, name) < high)]
+        objs.sort(key=lambda obj: (getattr(obj, name), obj.id))
+        return objs if limit is None else objs[:limit]
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+""" Incremental reading and writing of the JSON data files
+"""
+from typing import IO, Iterable, Iterator, Tuple
+import json
+
+
+CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader():
+    """ Sliding text buffer over a file object
+    """
+
+    def __init__(self, f: IO[str], chunk_size: int):
+        """ Initialize the buffer on `f`
+        """
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """ Drop the consumed text and read one more chunk,
+        return False at the end of the file
+        """
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        """ Move after the whitespace at the current position
+        """
+        while True:
+            while self.pos < len(self.buf) and \
+                    self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return
+
+    def expect(self, chars: str) -> str:
+        """ Consume and return the next significant character,
+        which must be one of `chars`
+        """
+        self.skip_whitespace()
+        if self.pos >= len(self.buf) or self.buf[self.pos] not in chars:
+            raise ValueError("Expected one of {!r} at offset {}"
+                             .format(chars, self.pos))
+        self.pos += 1
+        return self.buf[self.pos - 1]
+
+    def value(self):
+        """ Decode the JSON value at the current position, reading
+        more of the file until the value is complete
+        """
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            if end == len(self.buf) and self.fill():
+                # a number may continue in the next chunk
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_object(f: IO[str],
+                     chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple]:
+    """ Yield the (key, value) pairs of the JSON object stored in `f`
+    one at a time, without decoding the whole file in memory
+    """
+    reader = _Reader(f, chunk_size)
+    reader.skip_whitespace()
+    if reader.pos >= len(reader.buf):
+        return
+    reader.expect("{")
+    reader.skip_whitespace()
+    if reader.buf[reader.pos:reader.pos + 1] == "}":
+        return
+    while True:
+        key = reader.value()
+        if type(key) is not str:
+            raise ValueError("Object keys must be strings")
+        reader.expect(":")
+        yield key, reader.value()
+        if reader.expect(",}") == "}":
+            return
+
+
+def dump_json_object(items: Iterable[Tuple[str, dict]], f: IO[str]):
+    """ Write `items` as a JSON object with one member per line
+    """
+    sep = "{\n"
+    for key, value in items:
+        f.write(sep)
+        f.write(json.dumps(key))
+        f.write(": ")
+        f.write(json.dumps(value))
+        sep = ",\n"
+    f.write("{}\n" if sep == "{\n" else "\n}\n")
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+""" Migration of the data files to another number of shards
+
+Usage: python3 -m models.reshard COUNT [Class ...]
+
+Without class names, every model class is resharded. Stop the
+application first, then start it with DB_SHARDS=COUNT.
+"""
+import argparse
+import time
+from models.compact import CLASSES
+from models.engine.file_engine import reshard
+
+
+def main(argv: list = None):
+    """ Reshard the classes named in `argv` and print a report
+    """
+    parser = argparse.ArgumentParser(prog="python3 -m models.reshard")
+    parser.add_argument('count', type=int, help="number of shards")
+    parser.add_argument('classes', nargs='*', metavar='Class',
+                        help="one of: " + ", ".join(CLASSES))
+    args = parser.parse_args(argv)
+    if args.count < 1:
+        parser.error("the number of shards must be positive")
+    for name in args.classes:
+        if name not in CLASSES:
+            parser.error("unknown class: {}".format(name))
+    for name in args.classes or CLASSES:
+        start = time.monotonic()
+        stats = reshard(name, args.count)
+        print("{}: {} objects in {} files in {:.3f} s"
+              .format(name, stats['objects'], stats['files'],
+                      time.monotonic() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """Modèle de session utilisateur pour stocker
 les sessions dans la base de données."""
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 # Supposons que Base est votre classe de base pour l'ORM
 from models.base import Base
@@ -10,6 +10,12 @@ from models.base import Base
 class UserSession(Base):
     """Modèle de session utilisateur pour stocker les sessions."""
 
+    # Attributs propres à la session (disposition compacte sans __dict__)
+    __slots__ = ('user_id', 'session_id')
+
+    # Attributs indexés pour les recherches par égalité
+    indexed_attributes = ('session_id', 'user_id')
+
     def __init__(self, *args: list, **kwargs: dict):
         """Initialise une instance de UserSession.
 
@@ -41,3 +47,26 @@ class UserSession(Base):
         # Appelle le constructeur de la classe
         # de base pour compléter l'initialisation
         super().__init__(*args, **kwargs)
+
+    @classmethod
+    def remove_expired(cls, duration: int, limit: int = None) -> int:
+        """Supprime les sessions expirées, au plus `limit`, en un seul lot.
+
+        Une session expire `duration` secondes après sa création :
+        l'ordre d'expiration est celui de l'index trié de created_at,
+        qui donne les sessions expirées sans parcourir les autres.
+
+        Args:
+            duration (int): Durée de vie des sessions en secondes.
+            limit (int): Nombre maximal de sessions supprimées,
+            None pour toutes.
+
+        Returns:
+            int: Le nombre de sessions supprimées.
+        """
+        # Les sessions créées avant cette date sont expirées
+        limite = datetime.now() - timedelta(seconds=duration)
+        expirees = cls.created_between(None, limite, limit)
+        # Un seul lot : la classe est écrite une fois
+        cls.bulk_remove(expirees)
+        return len(expirees)
@@ -9,9 +9,10 @@ Auteur SAID LAMGHARI
 """
 
 from flask import Flask, jsonify, request
-from flask import redirect
+from flask import abort
 from flask import redirect
 from auth import Auth
+from rate_limit import login_keys, login_limiter
 
 # Initialisation de l'application Flask
 app = Flask(__name__)
@@ -75,13 +76,22 @@ def login() -> str:
 
     Retour:
         - JSON confirmant la connexion ou une erreur
-        401 si les informations sont incorrectes.
+        401 si les informations sont incorrectes, ou 429
+        après trop d'échecs récents de ce client ou pour cet email.
     """
     email = request.form.get("email")
     pssword = request.form.get("password")
 
+    # Refuse la tentative au-delà de la limite,
+    # avant la recherche de l'utilisateur et bcrypt
+    cles = login_keys(request.remote_addr, email)
+    if not login_limiter.allow(*cles):
+        return jsonify({"message": "too many attempts"}), 429
+
     # Vérification des informations de connexion
     if not AUTH.valid_login(email, pssword):
+        # Compte l'échec pour le client et pour l'email
+        login_limiter.failure(*cles)
         # Retourne une erreur 401 si l'email
         # ou le mot de passe est incorrect
         abort(401)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Ce module limite les échecs de connexion par
+client et par email avec des seaux à jetons,
+afin qu'une rafale de tentatives ne sature
+pas les workers avec des vérifications bcrypt.
+"""
+from collections import OrderedDict
+import os
+import threading
+import time
+from typing import Hashable
+
+
+class RateLimiter:
+    """Seaux à jetons indexés par clé (adresse du client, email...).
+
+    Chaque seau contient au plus `burst` jetons et en regagne
+    `per_minute` par minute ; un échec en consomme un, et une clé dont
+    un seau est vide est refusée. Les seaux sont rangés du moins au plus
+    récemment utilisé : un seau resté inactif assez longtemps pour être
+    plein équivaut à un seau absent et est retiré, et au-delà de
+    `max_keys` seaux le plus ancien est oublié. Chaque opération est
+    en O(1) amorti.
+    """
+
+    def __init__(self, burst: float = 10, per_minute: float = 10,
+                 max_keys: int = 10000) -> None:
+        """Initialise un limiteur sans seau.
+        """
+        self.capacity = float(burst)
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        # Durée d'inactivité après laquelle un seau est plein
+        self.idle = self.capacity / self.rate if self.rate > 0 \
+            else float('inf')
+        # Clé -> [jetons, instant de la mise à jour]
+        self._seaux = OrderedDict()
+        self._verrou = threading.Lock()
+        self._compteurs = {'failures': 0, 'rejected': 0}
+
+    @classmethod
+    def from_env(cls) -> 'RateLimiter':
+        """Crée un limiteur selon LOGIN_RATE_BURST (10 par défaut),
+        LOGIN_RATE_PER_MINUTE (10) et LOGIN_RATE_MAX_KEYS (10000).
+        """
+        try:
+            burst = float(os.getenv('LOGIN_RATE_BURST', '10'))
+            per_minute = float(os.getenv('LOGIN_RATE_PER_MINUTE', '10'))
+            max_keys = int(os.getenv('LOGIN_RATE_MAX_KEYS', '10000'))
+        except ValueError:
+            burst, per_minute, max_keys = 10, 10, 10000
+        return cls(burst, per_minute, max_keys)
+
+    @property
+    def enabled(self) -> bool:
+        """True si le limiteur refuse des tentatives
+        (LOGIN_RATE_BURST positif).
+        """
+        return self.capacity > 0 and self.max_keys > 0
+
+    def _jetons(self, seau: list, maintenant: float) -> float:
+        """Retourne les jetons de `seau` à l'instant `maintenant`.
+        """
+        return min(self.capacity,
+                   seau[0] + (maintenant - seau[1]) * self.rate)
+
+    def _expire(self, maintenant: float) -> None:
+        """Retire les seaux pleins et ceux au-delà de `max_keys`,
+        verrou tenu.
+        """
+        while self._seaux:
+            seau = next(iter(self._seaux.values()))
+            if maintenant - seau[1] < self.idle and \
+                    len(self._seaux) <= self.max_keys:
+                return
+            self._seaux.popitem(last=False)
+
+    def allow(self, *keys: Hashable) -> bool:
+        """Retourne False si le seau d'une des clés est vide.
+
+        Les clés None sont ignorées.
+        """
+        if not self.enabled:
+            return True
+        maintenant = time.monotonic()
+        with self._verrou:
+            for key in keys:
+                seau = self._seaux.get(key)
+                if seau is not None and \
+                        self._jetons(seau, maintenant) < 1:
+                    self._compteurs['rejected'] += 1
+                    return False
+        return True
+
+    def failure(self, *keys: Hashable) -> None:
+        """Consomme un jeton du seau de chaque clé non None.
+        """
+        if not self.enabled:
+            return
+        maintenant = time.monotonic()
+        with self._verrou:
+            self._compteurs['failures'] += 1
+            for key in keys:
+                if key is None:
+                    continue
+                seau = self._seaux.pop(key, None)
+                if seau is None:
+                    seau = [self.capacity, maintenant]
+                seau[0] = max(0.0, self._jetons(seau, maintenant) - 1)
+                seau[1] = maintenant
+                # Le seau devient le plus récemment utilisé
+                self._seaux[key] = seau
+            self._expire(maintenant)
+
+    def stats(self) -> dict:
+        """Retourne les échecs comptés, les tentatives
+        refusées et le nombre de seaux.
+        """
+        with self._verrou:
+            stats = dict(self._compteurs)
+            stats['buckets'] = len(self._seaux)
+        return stats
+
+
+def login_keys(address: str, email: str) -> tuple:
+    """Retourne les clés d'une tentative de connexion : l'adresse
+    du client et l'email visé, en minuscules.
+    """
+    return (None if address is None else ('address', address),
+            None if not isinstance(email, str)
+            else ('email', email.strip().lower()))
+
+
+# Limiteur des connexions (POST /sessions)
+login_limiter = RateLimiter.from_env()